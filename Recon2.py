@@ -1,25 +1,18 @@
 import streamlit as st
 import os
-import zipfile
-import tempfile
-from pathlib import Path
-from PIL import Image
-try:
-    import pillow_heif
-    pillow_heif.register_heif_opener()
-    HEIF_SUPPORT = True
-except ImportError:
-    HEIF_SUPPORT = False
-    st.warning("Для поддержки HEIC/HEIF установите пакет pillow-heif: pip install pillow-heif")
-import shutil
-from io import BytesIO
-import requests
 import uuid
-from rename import process_rename_mode
-from convers import process_convert_mode
-from water import process_watermark_mode
+# Режимы, Pillow, pillow_heif и requests (sinks.HttpUploadSink) импортируются там, где нужны:
+# первая страница открывается без загрузки кодеков (см. bench.py, замер startup)
+from heif import INSTALL_HINT, heif_available
+from archive import DEFAULT_VOLUME_MB
+from ingest import DUPLICATES_FANOUT, DUPLICATES_SKIP
+from results import discard_session
+from downloads import LARGE_JOB_MB, browser_volume_mb
+from sinks import UPLOAD_CHUNK_MB, BrowserDownloadSink, HttpUploadSink, LocalDirSink, export_dir, export_root, upload_endpoints
+from job_view import attach_job, collect_job, detach_job, download_result, job_running, show_job_progress, show_log
 
-pillow_heif.register_heif_opener()
+if not heif_available():
+    st.warning(INSTALL_HINT)
 
 SUPPORTED_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff', '.heic', '.heif')
 
@@ -37,7 +30,9 @@ with st.expander("ℹ️ Инструкция и ответы на вопрос
     - *Почему не все фото обработались?*  
       Возможно, некоторые файлы были повреждены или не поддерживаются.
     - *Что делать, если архив не скачивается?*  
-      Попробуйте уменьшить размер архива или разделить файлы на несколько частей.
+      Задайте в боковой панели «Размер тома архива»: результат будет разбит на части
+      (part1.zip, part2.zip…), в каждой сохраняются папки и лог. Готовые части можно
+      скачивать, пока обрабатываются остальные.
     """)
 
 if "reset_uploader" not in st.session_state:
@@ -46,24 +41,42 @@ if "log" not in st.session_state:
     st.session_state["log"] = []
 if "result_zip" not in st.session_state:
     st.session_state["result_zip"] = None
+if "result_parts" not in st.session_state:
+    st.session_state["result_parts"] = []
 if "stats" not in st.session_state:
     st.session_state["stats"] = {}
+if "metrics" not in st.session_state:
+    st.session_state["metrics"] = None
 if "mode" not in st.session_state:
     st.session_state["mode"] = "Переименование фото"
 
+# После перезагрузки страницы подключаемся к заданию из адреса (?job=…)
+attach_job()
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex
+collect_job()
+
 def reset_all():
+    detach_job()
+    discard_session(st.session_state["session_id"])
     st.session_state["reset_uploader"] += 1
     st.session_state["log"] = []
     st.session_state["result_zip"] = None
+    st.session_state["result_parts"] = []
     st.session_state["stats"] = {}
+    st.session_state["metrics"] = None
     st.session_state["mode"] = "Переименование фото"
 
+MODES = ["Переименование фото", "Конвертация", "Водяной знак", "Конвейер: конвертация + знак + нумерация"]
+CONVERT_MODE = MODES[1]
+PIPELINE_MODE = MODES[3]
+
 mode = st.radio(
     "Выберите режим работы:",
-    ["Переименование фото", "Конвертация в JPG", "Водяной знак"],
-    index=0 if st.session_state["mode"] == "Переименование фото" else (1 if st.session_state["mode"] == "Конвертация в JPG" else 2),
+    MODES,
+    index=MODES.index(st.session_state["mode"]),
     key="mode_radio",
-    on_change=lambda: st.session_state.update({"log": [], "result_zip": None, "stats": {}})
+    on_change=lambda: st.session_state.update({"log": [], "result_zip": None, "result_parts": [], "stats": {}, "metrics": None})
 )
 st.session_state["mode"] = mode
 
@@ -99,23 +112,18 @@ def filter_large_files(uploaded_files):
             filtered.append(f)
     return filtered
 
-# --- UI для режима Водяной знак ---
-if mode == "Водяной знак":
+# --- UI для режима Водяной знак (и для конвейера, где знак необязателен) ---
+if mode in ("Водяной знак", PIPELINE_MODE):
     st.markdown("**Выберите водяной знак (PNG/JPG):**")
-    import glob
-    from water import apply_watermark
+    from PIL import Image
+    from water import apply_watermark, get_first_image, list_watermark_presets, prepare_watermark, save_user_watermark
     watermark_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "watermarks"))
-    preset_files = []
-    if os.path.exists(watermark_dir):
-        preset_files = [f for f in os.listdir(watermark_dir) if f.lower().endswith((".png", ".jpg", ".jpeg"))]
+    preset_files = list_watermark_presets(watermark_dir)
     preset_choice = st.selectbox("Водяные знаки из папки watermarks/", ["Нет"] + preset_files)
     user_wm_file = st.file_uploader("Или загрузите свой PNG/JPG водяной знак", type=["png", "jpg", "jpeg"], key="watermark_upload")
     user_wm_path = None
     if user_wm_file is not None:
-        tmp_dir = tempfile.gettempdir()
-        user_wm_path = os.path.join(tmp_dir, f"user_wm_{user_wm_file.name}")
-        with open(user_wm_path, "wb") as f:
-            f.write(user_wm_file.read())
+        user_wm_path = save_user_watermark(user_wm_file)
     st.sidebar.header('Настройки водяного знака')
     opacity = st.sidebar.slider('Прозрачность', 0, 100, 60) / 100.0
     size_percent = st.sidebar.slider('Размер (% от ширины фото)', 5, 80, 25)
@@ -137,77 +145,204 @@ if mode == "Водяной знак":
 
     # --- Предпросмотр водяного знака ---
     st.markdown("**Предпросмотр водяного знака:**")
-    preview_img = None
-    def get_first_image(uploaded_files):
-        for file in uploaded_files:
-            if file.name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff', '.heic', '.heif')):
-                file.seek(0)
-                try:
-                    return Image.open(file)
-                except Exception:
-                    continue
-            elif file.name.lower().endswith('.zip'):
-                import zipfile
-                from io import BytesIO
-                file.seek(0)
-                with zipfile.ZipFile(file, 'r') as zf:
-                    for name in zf.namelist():
-                        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff', '.heic', '.heif')):
-                            with zf.open(name) as imgf:
-                                try:
-                                    return Image.open(BytesIO(imgf.read()))
-                                except Exception:
-                                    continue
-        return None
+    # Предпросмотр строится по уменьшенной копии из кэша: слайдеры пересчитывают только наложение
     preview_img = get_first_image(uploaded_files) if uploaded_files else None
     if preview_img is None:
         preview_img = Image.new("RGB", (400, 300), bg_color)
-    wm_path = None
+    # Знак берётся из общего кэша water.py: при движении слайдеров PNG не перечитывается с диска
+    wm_source = None
     if preset_choice != "Нет":
-        wm_path = os.path.join(watermark_dir, preset_choice)
+        wm_source = os.path.join(watermark_dir, preset_choice)
     elif user_wm_file:
-        tmp_dir = tempfile.gettempdir()
-        wm_path = os.path.join(tmp_dir, f"user_wm_{user_wm_file.name}")
-        with open(wm_path, "wb") as f:
-            f.write(user_wm_file.getvalue() if hasattr(user_wm_file, 'getvalue') else user_wm_file.read())
+        wm_source = user_wm_file.getvalue()
     try:
-        if wm_path:
-            preview = apply_watermark(preview_img, watermark_path=wm_path, position=pos_map[position], opacity=opacity, scale=size_percent/100.0)
+        if wm_source:
+            watermark = prepare_watermark(wm_source, int(preview_img.width * size_percent / 100.0), opacity)
+            preview = apply_watermark(preview_img, position=pos_map[position], watermark=watermark)
         else:
             preview = preview_img
         st.image(preview, caption="Предпросмотр", use_container_width=True)
     except Exception as e:
         st.warning(f"Ошибка предпросмотра: {e}")
 
+# --- Число процессов и профиль кодировщика для конвертации, водяного знака и конвейера ---
+if mode in (CONVERT_MODE, "Водяной знак", PIPELINE_MODE):
+    from budget import server_budget_mb
+    from encoders import DEFAULT_PROFILE, PROFILES
+    from parallel import default_workers
+    max_workers = default_workers()
+    workers = st.sidebar.number_input(
+        "Процессов обработки", min_value=1, max_value=max_workers, value=max_workers, step=1,
+        help="Сколько изображений задания обрабатывается одновременно. Процессы общие для всех "
+             "пользователей сервера и делятся между заданиями поровну.",
+    )
+    profile = st.sidebar.selectbox(
+        "Профиль качества",
+        list(PROFILES),
+        index=list(PROFILES).index(DEFAULT_PROFILE),
+        format_func=lambda name: PROFILES[name].label,
+    )
+    # Бюджет памяти задаёт оператор (см. budget.py); пользователь может только уменьшить его для своего задания
+    memory_budget_mb = server_budget_mb()
+    if memory_budget_mb:
+        memory_budget_mb = st.sidebar.number_input(
+            "Бюджет памяти задания, МБ",
+            min_value=min(256, memory_budget_mb),
+            max_value=memory_budget_mb,
+            value=memory_budget_mb,
+            step=256,
+            help=f"Сколько памяти могут занимать одновременно декодируемые изображения задания, не больше "
+                 f"{memory_budget_mb} МБ — бюджета сервера, общего для всех заданий. "
+                 f"Слишком большие JPEG декодируются уменьшенными, остальные пропускаются.",
+        )
+    # Управление цветом: CMYK и широкий охват переводятся в sRGB по встроенному ICC-профилю
+    from colorspace import DEFAULT_INTENT, INTENT_LABELS
+    srgb = None
+    if st.sidebar.checkbox("Перевести в sRGB по ICC-профилю", value=False,
+                           help="Без этого цвета CMYK и Adobe RGB/Display P3 переводятся упрощённо, "
+                                "а к результату прикладывается исходный профиль."):
+        srgb = st.sidebar.selectbox(
+            "Цель рендеринга",
+            list(INTENT_LABELS),
+            index=list(INTENT_LABELS).index(DEFAULT_INTENT),
+            format_func=INTENT_LABELS.get,
+        )
+
+# --- Формат результата конвертации: WebP/AVIF заметно меньше JPEG того же качества ---
+output_format, encoder_effort = "jpeg", None
+if mode == CONVERT_MODE:
+    from encoders import DEFAULT_EFFORT, DEFAULT_FORMAT, EFFORT_LABELS, OUTPUT_FORMATS, available_formats
+    formats = available_formats()
+    output_format = st.sidebar.selectbox(
+        "Формат результата",
+        formats,
+        index=formats.index(DEFAULT_FORMAT),
+        format_func=lambda name: OUTPUT_FORMATS[name].label,
+        help="Качество берётся из профиля. Форматы, которые не поддерживает установленный Pillow, не показываются.",
+    )
+    encoder_effort = DEFAULT_EFFORT
+    if output_format != "jpeg":
+        encoder_effort = st.sidebar.selectbox(
+            "Скорость кодирования",
+            list(EFFORT_LABELS),
+            index=list(EFFORT_LABELS).index(DEFAULT_EFFORT),
+            format_func=EFFORT_LABELS.get,
+        )
+
+# --- Дубликаты (перекрывающиеся архивы) обрабатываются один раз ---
+skip_duplicates = st.sidebar.checkbox(
+    "Пропускать дубликаты",
+    value=False,
+    help="Одинаковые файлы обрабатываются один раз. Если отмечено, копии не попадают в архив, "
+         "иначе результат копируется под путями всех копий.",
+)
+duplicates = DUPLICATES_SKIP if skip_duplicates else DUPLICATES_FANOUT
+volume_mb = st.sidebar.number_input(
+    "Размер тома архива, МБ (0 — один архив)",
+    min_value=0,
+    value=DEFAULT_VOLUME_MB,
+    step=100,
+    help="Большой результат разбивается на части заданного размера; каждая часть скачивается отдельно.",
+)
+# --- Куда отправить результат: тома уходят по мере готовности ---
+# Папка на сервере и загрузка по HTTP — только в пределах настроек оператора (см. sinks.py)
+sink_root = export_root()
+sink_urls = upload_endpoints()
+sink_options = [BrowserDownloadSink.label]
+if sink_root:
+    sink_options.append(LocalDirSink.label)
+if sink_urls:
+    sink_options.append(HttpUploadSink.label)
+sink_choice = BrowserDownloadSink.label
+if len(sink_options) > 1:
+    sink_choice = st.sidebar.selectbox("Куда отправить результат", sink_options)
+sink = None
+if sink_choice == LocalDirSink.label:
+    export_name = st.sidebar.text_input(
+        "Подпапка для результата",
+        value="",
+        help=f"Папка внутри {sink_root}; пусто — сама эта папка.",
+    )
+    try:
+        sink = LocalDirSink(export_dir(sink_root, export_name))
+    except ValueError as e:
+        st.sidebar.error(f"Недопустимая папка: {e}")
+elif sink_choice == HttpUploadSink.label:
+    upload_url = sink_urls[0]
+    if len(sink_urls) > 1:
+        upload_url = st.sidebar.selectbox("Адрес загрузки", sink_urls)
+    upload_chunk_mb = st.sidebar.number_input("Размер части загрузки, МБ", min_value=1, value=UPLOAD_CHUNK_MB, step=1)
+    sink = HttpUploadSink(upload_url, chunk_mb=upload_chunk_mb)
+# Без маршрута скачивания (app.py) архив отдаётся через память сервера: большое задание делится на тома
+if uploaded_files and (sink is None or sink.in_browser):
+    job_volume_mb = browser_volume_mb(volume_mb, sum(f.size for f in uploaded_files))
+    if job_volume_mb != volume_mb:
+        st.sidebar.caption(f"Загрузки больше {LARGE_JOB_MB} МБ: результат будет разбит на тома по {job_volume_mb} МБ.")
+        volume_mb = job_volume_mb
+if mode == PIPELINE_MODE:
+    pipeline_rename = st.sidebar.checkbox("Нумеровать файлы по папкам (1.jpg, 2.jpg…)", value=True)
+
 # --- Кнопка обработки для режима Переименование фото ---
-if mode == "Переименование фото":
-    process_rename_mode(uploaded_files)
-elif mode == "Конвертация в JPG":
-    process_convert_mode(uploaded_files)
+if job_running():
+    # Задание идёт в фоне: показываем его прогресс вместо кнопки запуска
+    show_job_progress()
+elif mode == "Переименование фото":
+    from rename import process_rename_mode
+    process_rename_mode(uploaded_files, duplicates=duplicates, volume_mb=volume_mb, sink=sink)
+elif mode == CONVERT_MODE:
+    from convers import process_convert_mode
+    process_convert_mode(uploaded_files, workers=workers, profile=profile, memory_budget_mb=memory_budget_mb, duplicates=duplicates, volume_mb=volume_mb, sink=sink, srgb=srgb, output=output_format, effort=encoder_effort)
 elif mode == "Водяной знак":
-    process_watermark_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position)
+    from water import process_watermark_mode
+    process_watermark_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position, workers=workers, profile=profile, memory_budget_mb=memory_budget_mb, duplicates=duplicates, volume_mb=volume_mb, sink=sink, srgb=srgb)
+elif mode == PIPELINE_MODE:
+    from pipeline import process_pipeline_mode
+    process_pipeline_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position, rename=pipeline_rename, workers=workers, profile=profile, memory_budget_mb=memory_budget_mb, duplicates=duplicates, volume_mb=volume_mb, sink=sink, srgb=srgb)
 
 # Универсальный блок скачивания архива и лога для всех режимов
-if st.session_state.get("result_zip"):
-    st.download_button(
-        label="📥 Скачать архив",
-        data=st.session_state["result_zip"],
-        file_name=(
-            "renamed_photos.zip" if mode == "Переименование фото"
-            else "converted_photos.zip" if mode == "Конвертация в JPG"
-            else "watermarked_images.zip"
-        ),
-        mime="application/zip"
+result_handle = st.session_state.get("result_zip")
+if result_handle and result_handle.exists():
+    # В session_state хранится только путь; как архив попадает в браузер — см. downloads.py
+    archive_name = (
+        "renamed_photos" if mode == "Переименование фото"
+        else "processed_photos" if mode == PIPELINE_MODE
+        else "watermarked_images"
     )
+    if mode == CONVERT_MODE:
+        from encoders import DEFAULT_FORMAT, OUTPUT_FORMATS
+        result_stats = st.session_state.get("stats") or {}
+        # Формат — тот, в котором задание выполнено: в боковой панели его могли уже сменить
+        result_format = OUTPUT_FORMATS[result_stats.get("format", DEFAULT_FORMAT)]
+        archive_name = f"converted_{result_format.suffix[1:]}"
+        if "converted" in result_stats:
+            st.success(f"Конвертировано в {result_format.title}: {result_stats['converted']} из {result_stats['total']}")
+    result_parts = st.session_state.get("result_parts") or [result_handle]
+    if len(result_parts) == 1:
+        download_result("📥 Скачать архив", result_handle.path, f"{archive_name}.zip")
+    else:
+        for i, part in enumerate(result_parts, 1):
+            download_result(f"📥 Скачать том {i} из {len(result_parts)} ({part.size / (1024 * 1024):.1f} МБ)",
+                            part.path, f"{archive_name}.part{i}.zip", key=f"result_part_{i}")
+    for name, location, error in st.session_state.get("deliveries", []):
+        if error:
+            st.error(f"📤 {name}: не отправлен ({error})")
+        else:
+            st.success(f"📤 {name} отправлен: {location}")
+    # Лог целиком читается из файла только при скачивании
     st.download_button(
         label="📄 Скачать лог в .txt",
-        data="\n".join(st.session_state["log"]),
+        data=st.session_state["log"].text,
         file_name="log.txt",
         mime="text/plain"
     )
-    if mode == "Переименование фото":
+    if mode in ("Переименование фото", CONVERT_MODE, PIPELINE_MODE):
         with st.expander("Показать лог обработки"):
-            st.text_area("Лог:", value="\n".join(st.session_state["log"]), height=300, disabled=True)
+            show_log(st.session_state["log"])
+    if st.session_state.get("metrics"):
+        # Подробные замеры по файлам лежат в архиве как metrics.json
+        with st.expander("⏱️ Сводка по этапам обработки"):
+            st.caption(st.session_state["metrics"]["headline"])
+            st.table(st.session_state["metrics"]["rows"])
 else:
     st.write("Архив не создан")
 
@@ -220,18 +355,3 @@ if st.button("🔄 Начать сначала", type="primary"):
 # if st.button("Обработать и скачать архив"):
 #     ...
 # (Вся логика обработки уже реализована выше внутри блока 'Водяной знак')
-
-# --- Функция для загрузки на TransferNow ---
-def upload_to_transfernow(file_path):
-    url = "https://api.transfernow.net/v2/transfers"
-    with open(file_path, 'rb') as f:
-        files = {'files': (os.path.basename(file_path), f)}
-        data = {
-            'message': 'Ваш файл готов!',
-            'email_from': 'noreply@photoflow.local'
-        }
-        response = requests.post(url, files=files, data=data)
-    if response.status_code == 201:
-        return response.json().get('download_url')
-    else:
-        return None
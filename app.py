@@ -0,0 +1,14 @@
+# app.py
+"""
+Запуск приложения с отдачей результатов прямо с диска:
+
+    streamlit run app.py
+
+Интерфейс тот же (Recon2.py), но архивы скачиваются маршрутом /download/…,
+а не через память сервера (см. downloads.py).
+"""
+import streamlit as st
+
+from downloads import routes
+
+app = st.App("Recon2.py", routes=routes())
@@ -0,0 +1,211 @@
+# archive.py
+"""
+Запись ZIP-архивов результата.
+
+VolumeWriter разбивает результат на тома не больше заданного размера
+(part1.zip, part2.zip…), в каждом томе сохраняется структура папок и лог.
+Метод сжатия выбирается по типу записи: уже сжатые изображения хранятся
+как есть (STORED), лог и замеры сжимаются (DEFLATED).
+"""
+import os
+import shutil
+import struct
+import time
+import zipfile
+from typing import Callable, List, Optional
+
+_MASK_ENCRYPTED = 0x01
+_MASK_DATA_DESCRIPTOR = 0x08
+_FH_FILENAME_LENGTH = 10
+_FH_EXTRA_FIELD_LENGTH = 11
+_DD_SIGNATURE = 0x08074b50
+_COPY_CHUNK = 1024 * 1024
+
+
+def copy_member_raw(src: zipfile.ZipFile, info: zipfile.ZipInfo, dst: zipfile.ZipFile, arcname: str):
+    """
+    Копирует член архива src в dst под новым именем, не распаковывая
+    и не сжимая данные заново: переносятся сжатые байты, CRC и размеры.
+    Зашифрованные члены переносятся так же: заголовок шифра входит в compress_size,
+    и пароль для результата остаётся прежним.
+    Перенос опирается на внутренние поля zipfile; если в этой версии Python их нет,
+    член распаковывается и сжимается заново (зашифрованный без пароля — RuntimeError).
+    """
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.create_system = info.create_system
+    zinfo.external_attr = info.external_attr
+    zinfo.extract_version = info.extract_version
+    # Размеры известны заранее, поэтому дескриптор данных после тела не нужен. Кроме зашифрованных членов:
+    # с этим флагом байт проверки пароля в заголовке шифра сверяется со временем, а не с CRC
+    descriptor = bool(info.flag_bits & _MASK_ENCRYPTED and info.flag_bits & _MASK_DATA_DESCRIPTOR)
+    zinfo.flag_bits = info.flag_bits if descriptor else info.flag_bits & ~_MASK_DATA_DESCRIPTOR
+    try:
+        _copy_compressed(src, info, dst, zinfo, descriptor)
+    except AttributeError:
+        _copy_recompressed(src, info, dst, arcname)
+
+
+def _copy_compressed(src: zipfile.ZipFile, info: zipfile.ZipInfo, dst: zipfile.ZipFile,
+                     zinfo: zipfile.ZipInfo, descriptor: bool):
+    """Перенос сжатых байт через внутренние поля zipfile (_lock, fp, start_dir, _writecheck…)."""
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    with src._lock:
+        fp = src.fp
+        fp.seek(info.header_offset)
+        header = struct.unpack(zipfile.structFileHeader, fp.read(zipfile.sizeFileHeader))
+        if header[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Некорректный локальный заголовок для {info.filename}")
+        fp.seek(header[_FH_FILENAME_LENGTH] + header[_FH_EXTRA_FIELD_LENGTH], 1)
+
+        with dst._lock:
+            if dst._seekable:
+                dst.fp.seek(dst.start_dir)
+            zinfo.header_offset = dst.fp.tell()
+            dst._writecheck(zinfo)
+            dst._didModify = True
+            dst.fp.write(zinfo.FileHeader(zip64))
+            remaining = info.compress_size
+            while remaining:
+                chunk = fp.read(min(remaining, _COPY_CHUNK))
+                if not chunk:
+                    raise EOFError(f"Архив обрывается внутри {info.filename}")
+                dst.fp.write(chunk)
+                remaining -= len(chunk)
+            if descriptor:
+                dst.fp.write(struct.pack("<LLQQ" if zip64 else "<LLLL", _DD_SIGNATURE,
+                                         zinfo.CRC, zinfo.compress_size, zinfo.file_size))
+            dst.filelist.append(zinfo)
+            dst.NameToInfo[zinfo.filename] = zinfo
+            dst.start_dir = dst.fp.tell()
+
+
+def _copy_recompressed(src: zipfile.ZipFile, info: zipfile.ZipInfo, dst: zipfile.ZipFile, arcname: str):
+    """Запасной путь copy_member_raw: распаковка и повторное сжатие тем же методом."""
+    zinfo = zipfile.ZipInfo(arcname, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.create_system = info.create_system
+    zinfo.external_attr = info.external_attr
+    zinfo.file_size = info.file_size
+    with src.open(info) as fsrc, dst.open(zinfo, "w") as fdst:
+        shutil.copyfileobj(fsrc, fdst, _COPY_CHUNK)
+
+
+DEFAULT_VOLUME_MB = 0        # 0 — без разбиения на тома
+# Данные в этих форматах уже сжаты: повторное сжатие тратит CPU почти без выигрыша
+STORED_EXTS = ('.jpg', '.jpeg', '.png', '.heic', '.heif', '.webp', '.avif', '.zip')
+
+
+def compress_type_for(arcname: str) -> int:
+    return zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTS) else zipfile.ZIP_DEFLATED
+
+
+def volume_bytes(volume_mb: Optional[int]) -> Optional[int]:
+    return volume_mb * 1024 * 1024 if volume_mb else None
+
+
+def _zip_info(arcname: str) -> zipfile.ZipInfo:
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+    zinfo.compress_type = compress_type_for(arcname)
+    zinfo.external_attr = 0o600 << 16
+    return zinfo
+
+
+class VolumeWriter:
+    """
+    Архив результата, который при превышении max_bytes продолжается в новом томе.
+    Пока том один, он лежит по исходному пути; при первом переполнении
+    переименовывается в <имя>.part1.zip, следующие — .part2.zip и т. д.
+    Размер тома соблюдается приблизительно: запись не делится между томами.
+    """
+
+    def __init__(self, path: str, max_bytes: int = None, log: List[str] = None,
+                 on_volume: Callable[[str], None] = None):
+        """
+        :param log: Лог задания; снимок кладётся в каждый завершённый том
+        :param on_volume: Вызывается с путём каждого завершённого тома (кроме последнего)
+        """
+        self.path = path
+        self.max_bytes = max_bytes or None
+        self.log = log if log is not None else []
+        self.on_volume = on_volume
+        self.paths: List[str] = []       # завершённые тома
+        self._base = path[:-4] if path.lower().endswith(".zip") else path
+        self._zf: Optional[zipfile.ZipFile] = zipfile.ZipFile(path, "w")
+        self._current = path
+        self._entries = 0
+
+    def _part_path(self, index: int) -> str:
+        return f"{self._base}.part{index}.zip"
+
+    def _reserve(self, size: int):
+        """Начинает новый том, если запись размером size не помещается в текущий."""
+        if not self.max_bytes or not self._entries:
+            return
+        if self._zf.fp.tell() + size <= self.max_bytes:
+            return
+        self._write_log(self._zf)
+        self._zf.close()
+        if not self.paths:
+            # Первый том был записан под исходным именем
+            os.replace(self._current, self._part_path(1))
+            self._current = self._part_path(1)
+        self.paths.append(self._current)
+        self.log.append(f"📦 Том {len(self.paths)} готов: {os.path.basename(self._current)}")
+        if self.on_volume:
+            self.on_volume(self._current)
+        self._current = self._part_path(len(self.paths) + 1)
+        self._zf = zipfile.ZipFile(self._current, "w")
+        self._entries = 0
+
+    def _write_log(self, zf: zipfile.ZipFile):
+        zf.writestr(_zip_info("log.txt"), "\n".join(self.log))
+
+    def writestr(self, arcname: str, data: bytes):
+        self._reserve(len(data))
+        self._zf.writestr(_zip_info(arcname), data)
+        self._entries += 1
+
+    def open(self, arcname: str, size: int):
+        """Поток для записи члена, размер которого известен заранее (для выбора тома)."""
+        self._reserve(size)
+        self._entries += 1
+        return self._zf.open(_zip_info(arcname), "w", force_zip64=size > zipfile.ZIP64_LIMIT)
+
+    def copy_raw(self, src: zipfile.ZipFile, info: zipfile.ZipInfo, arcname: str):
+        """Перенос члена другого архива без распаковки (см. copy_member_raw)."""
+        self._reserve(info.compress_size)
+        copy_member_raw(src, info, self._zf, arcname)
+        self._entries += 1
+
+    def finish(self, metrics=None) -> List[str]:
+        """Кладёт полный лог и замеры в последний том и закрывает его. Возвращает пути всех томов."""
+        self._write_log(self._zf)
+        if metrics is not None:
+            self._zf.writestr(_zip_info("metrics.json"), metrics.to_json())
+        self._zf.close()
+        self._zf = None
+        self.paths.append(self._current)
+        return self.paths
+
+    def abort(self):
+        """Закрывает и удаляет все тома (например, перед записью архива только с логом)."""
+        if self._zf is not None:
+            self._zf.close()
+            self._zf = None
+        for path in self.paths + [self._current]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
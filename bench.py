@@ -0,0 +1,265 @@
+# bench.py
+"""
+Воспроизводимый бенчмарк режимов обработки (включая конвейер).
+
+Генерирует синтетический набор изображений (JPEG, PNG с альфа-каналом,
+большие TIFF, HEIC при наличии pillow_heif), упаковывает его в ZIP-архивы
+с вложенными папками и прогоняет через engine.run_* без Streamlit.
+Каждый режим запускается в отдельном процессе, чтобы пик RSS не смешивался.
+Отдельно замеряется холодный старт страницы: первый прогон Recon2.py
+в новом процессе и список тяжёлых модулей, загруженных при этом.
+Результаты сохраняются в JSON, чтобы прогоны можно было сравнивать.
+
+Примеры:
+    python bench.py --count 200 --size 3000x2000 -o bench.json
+    python bench.py --count 200 --compare bench_before.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+MODES = ["rename", "convert", "watermark", "pipeline"]
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WATERMARK = os.path.join(APP_DIR, "watermarks", "raindrop-graphic-circular-sticker-png.png")
+# Модули, которые не должны загружаться при открытии страницы (подгружаются по требованию)
+LAZY_MODULES = ["requests", "pillow_heif", "convers", "water"]
+
+# Первый запуск скрипта приложения в чистом интерпретаторе (Streamlit в «голом» режиме)
+_STARTUP_SNIPPET = """
+import json, runpy, sys, time
+t = time.perf_counter()
+import streamlit
+t_streamlit = time.perf_counter() - t
+runpy.run_path("Recon2.py", run_name="__main__")
+total = time.perf_counter() - t
+print(json.dumps({"seconds": total, "streamlit_import": t_streamlit, "modules": len(sys.modules),
+                  "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def _synthetic_image(rng: random.Random, size, mode="RGB") -> Image.Image:
+    """Градиент с фигурами: сжимается похоже на фотографию, а не на заливку."""
+    w, h = size
+    img = Image.linear_gradient("L").resize(size).convert(mode)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        x1, y1 = x0 + rng.randrange(w // 4 + 1), y0 + rng.randrange(h // 4 + 1)
+        fill = tuple(rng.randrange(256) for _ in range(len(mode)))
+        draw.ellipse([x0, y0, x1, y1], fill=fill)
+    return img
+
+
+def generate_corpus(root: str, count: int, size, formats, archives: int, depth: int, seed: int = 0) -> dict:
+    """
+    Создаёт count изображений, разложенных по archives ZIP-архивам
+    с вложенностью папок depth. Возвращает описание набора.
+    """
+    rng = random.Random(seed)
+    os.makedirs(root, exist_ok=True)
+    zips = [zipfile.ZipFile(os.path.join(root, f"corpus_{i + 1}.zip"), "w") for i in range(max(archives, 1))]
+    by_format = {}
+    total_bytes = 0
+    for i in range(count):
+        fmt = formats[i % len(formats)]
+        if fmt == "png":
+            img, ext, params = _synthetic_image(rng, size, "RGBA"), "png", {}
+        elif fmt == "tiff":
+            # Большие TIFF: вдвое больше по каждой стороне
+            img, ext, params = _synthetic_image(rng, (size[0] * 2, size[1] * 2)), "tiff", {}
+        elif fmt == "heic":
+            img, ext, params = _synthetic_image(rng, size), "heic", {"quality": 90}
+        elif fmt == "jpg":
+            img, ext, params = _synthetic_image(rng, size), "jpg", {"quality": 92}
+        else:
+            raise ValueError(f"Неизвестный формат: {fmt}")
+        folders = [f"set_{i % 3}"] + [f"level_{d}" for d in range(1, depth)]
+        arcname = "/".join(folders + [f"img_{i:05d}.{ext}"])
+        buf = BytesIO()
+        img.save(buf, {"jpg": "JPEG", "heic": "HEIF"}.get(ext, ext.upper()), **params)
+        zips[i % len(zips)].writestr(arcname, buf.getvalue())
+        by_format[fmt] = by_format.get(fmt, 0) + 1
+        total_bytes += buf.tell()
+    paths = []
+    for zf in zips:
+        zf.close()
+        paths.append(zf.filename)
+    return {"archives": paths, "count": count, "size": list(size), "formats": by_format, "bytes": total_bytes}
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss на Linux в КБ; учитываем и процессы пула
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def _run_mode(mode: str, archives, out_dir: str, workers: int, profile: str, watermark: str, queue):
+    """Выполняется в отдельном процессе: один режим, один архив результата."""
+    from engine import run_convert, run_pipeline, run_rename, run_watermark
+    from ingest import iter_paths
+    from metrics import JobMetrics
+
+    metrics = JobMetrics(mode)
+    start = time.perf_counter()
+    log = []
+    with metrics.span("ingest"):
+        sources = list(iter_paths(archives, log))
+    result_zip = os.path.join(out_dir, f"result_{mode}.zip")
+    t = time.perf_counter()
+    if mode == "rename":
+        result = run_rename(sources, result_zip, log, metrics=metrics)
+    elif mode == "convert":
+        result = run_convert(sources, result_zip, log, workers=workers, profile=profile, metrics=metrics)
+    elif mode == "pipeline":
+        result = run_pipeline(sources, result_zip, watermark, log=log, workers=workers, profile=profile, metrics=metrics)
+    else:
+        result = run_watermark(sources, result_zip, watermark, log=log, workers=workers, profile=profile, metrics=metrics)
+    # Этапы decode/transform/encode суммируются по файлам (при нескольких процессах больше времени на часах)
+    stages = dict(result.metrics.stage_totals)
+    stages["wall_process_and_archive"] = time.perf_counter() - t
+    total = time.perf_counter() - start
+    bytes_in = sum(src.size for src in sources)
+    queue.put({
+        "mode": mode,
+        "images": len(sources),
+        "bytes_in": bytes_in,
+        "bytes_out": os.path.getsize(result_zip),
+        "seconds": total,
+        "images_per_sec": len(sources) / total if total else 0.0,
+        "mb_per_sec": bytes_in / (1024 * 1024) / total if total else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages,
+        "stats": result.stats,
+    })
+
+
+def measure_startup(runs: int = 3) -> dict:
+    """
+    Холодный старт страницы: импорт Streamlit и первый прогон Recon2.py
+    в новом процессе. Берётся медиана из нескольких запусков.
+    """
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", _STARTUP_SNIPPET % LAZY_MODULES],
+            cwd=APP_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    samples.sort(key=lambda r: r["seconds"])
+    result = samples[len(samples) // 2]
+    result["app_seconds"] = result["seconds"] - result["streamlit_import"]
+    return result
+
+
+def run_benchmark(archives, modes, workers: int, profile: str, watermark: str) -> list:
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for mode in modes:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=_run_mode, args=(mode, archives, out_dir, workers, profile, watermark, queue))
+            proc.start()
+            results.append(queue.get())
+            proc.join()
+    return results
+
+
+def _parse_size(value: str):
+    w, h = value.lower().split("x")
+    return int(w), int(h)
+
+
+def compare(current: list, baseline: list):
+    """Печатает отношение изображений/сек к прошлому прогону (>1 — быстрее)."""
+    before = {r["mode"]: r for r in baseline}
+    for r in current:
+        old = before.get(r["mode"])
+        if not old or not old["images_per_sec"]:
+            continue
+        ratio = r["images_per_sec"] / old["images_per_sec"]
+        print(f"{r['mode']:>10}: {old['images_per_sec']:.2f} → {r['images_per_sec']:.2f} изобр./сек (×{ratio:.2f}), "
+              f"RSS {old['peak_rss_mb']:.0f} → {r['peak_rss_mb']:.0f} МБ")
+
+
+def main(argv=None) -> int:
+    from encoders import DEFAULT_PROFILE, PROFILES
+    from heif import register_heif
+    from parallel import default_workers
+
+    parser = argparse.ArgumentParser(description="Бенчмарк режимов PhotoFlow")
+    parser.add_argument("--count", type=int, default=60, help="число изображений")
+    parser.add_argument("--size", type=_parse_size, default=(2000, 1500), help="размер, например 3000x2000")
+    parser.add_argument("--formats", default="jpg,png,tiff,heic", help="форматы через запятую: jpg,png,tiff,heic")
+    parser.add_argument("--archives", type=int, default=2, help="на сколько ZIP разложить набор")
+    parser.add_argument("--depth", type=int, default=2, help="вложенность папок внутри ZIP")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE)
+    parser.add_argument("--watermark", default=DEFAULT_WATERMARK)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--no-startup", action="store_true", help="не замерять холодный старт страницы")
+    args = parser.parse_args(argv)
+
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+    if "heic" in formats and not register_heif():
+        print("pillow_heif не установлен — HEIC пропущен", file=sys.stderr)
+        formats.remove("heic")
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        t = time.perf_counter()
+        corpus = generate_corpus(corpus_dir, args.count, args.size, formats, args.archives, args.depth, args.seed)
+        corpus["generate_seconds"] = time.perf_counter() - t
+        results = run_benchmark(corpus["archives"], args.modes.split(","), args.workers, args.profile, args.watermark)
+    corpus.pop("archives")
+    startup = None if args.no_startup else measure_startup()
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "workers": args.workers,
+            "profile": args.profile,
+            "seed": args.seed,
+        },
+        "corpus": corpus,
+        "startup": startup,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for r in results:
+        stages = ", ".join(f"{k}: {v:.2f} с" for k, v in r["stages"].items())
+        print(f"{r['mode']:>10}: {r['images']} изобр., {r['images_per_sec']:.2f} изобр./сек, "
+              f"{r['mb_per_sec']:.1f} МБ/сек, пик RSS {r['peak_rss_mb']:.0f} МБ ({stages})")
+    if startup:
+        print(f"{'startup':>10}: {startup['seconds']:.2f} с (Streamlit {startup['streamlit_import']:.2f} с, "
+              f"приложение {startup['app_seconds']:.2f} с), модулей {startup['modules']}, "
+              f"загружены заранее: {', '.join(startup['loaded']) or 'нет'}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        compare(results, baseline["results"])
+        if startup and baseline.get("startup"):
+            print(f"{'startup':>10}: {baseline['startup']['seconds']:.2f} → {startup['seconds']:.2f} с")
+    print(f"Результаты сохранены в {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# budget.py
+"""
+Ограничение памяти при декодировании.
+
+Перед обработкой читается только заголовок изображения (формат, размеры,
+режим), по нему оценивается объём памяти на декодирование и результат.
+Задачи допускаются в пул, пока сумма оценок в работе не превышает бюджет.
+Бюджет сервера задаёт оператор (PHOTOFLOW_MEMORY_BUDGET_MB, 0 — без ограничения):
+он общий для всех заданий общего пула (parallel.FairPool), а пользователь
+может задать для своего задания только меньший.
+Изображение, которое в бюджет не помещается даже в одиночку, декодируется
+в уменьшенном виде (JPEG — через draft, 1/2…1/8) или пропускается.
+
+Предел Pillow на число пикселей (Image.MAX_IMAGE_PIXELS) общий для процесса,
+поэтому в процессе сервера он не меняется никогда: там открываются и
+предпросмотры, и знаки других сессий. Размер изображения сверх предела
+читается из заголовка без него (open_header), и решение принимает бюджет.
+Снимается предел только в процессах пула, и только если бюджет задан
+(set_decode_budget), на время декодирования допущенного изображения
+(admitted_decode). Без бюджета действует проверка Pillow.
+"""
+import os
+import struct
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+MEMORY_BUDGET_MB = 2048
+MEMORY_BUDGET_ENV = "PHOTOFLOW_MEMORY_BUDGET_MB"
+REDUCE_FACTORS = (2, 4, 8)      # масштабы, которые JPEG умеет декодировать без полного кадра
+
+# Байт на пиксель для режимов, у которых канал шире одного байта
+_MODE_BYTES = {"I": 4, "F": 4, "I;16": 2, "I;16B": 2, "I;16L": 2, "I;16N": 2}
+
+
+class ImageHeader(NamedTuple):
+    format: str
+    width: int
+    height: int
+    mode: str
+
+
+_decode_budget = None      # бюджет, которым проверены все изображения, декодируемые этим процессом
+
+
+def set_decode_budget(budget: Optional[int]):
+    """
+    Инициализатор процессов пула (и консольного запуска, где процесс один):
+    все изображения, которые декодирует процесс, прошли бюджет budget.
+    В процессе сервера не вызывается.
+    """
+    global _decode_budget
+    _decode_budget = budget
+
+
+@contextmanager
+def admitted_decode():
+    """
+    Открытие изображения, допущенного бюджетом: если процессу задан бюджет (set_decode_budget),
+    предел Pillow на число пикселей снимается на время блока. Процесс пула выполняет одну задачу
+    за раз, поэтому другие открытия изображений (водяной знак) предел не теряют.
+    """
+    if not _decode_budget:
+        yield
+        return
+    saved = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = saved
+
+
+def open_header(fp) -> Image.Image:
+    """
+    Открывает изображение, которое Image.open отвергает по пределу на число пикселей
+    (DecompressionBombError), не меняя сам предел. Формат подбирается, как в Image.open,
+    по зарегистрированным модулям Pillow. Только для чтения заголовка: пиксели не загружать.
+    :raises UnidentifiedImageError: если ни один модуль формат не принял
+    """
+    Image.init()
+    fp.seek(0)
+    prefix = fp.read(16)
+    for fmt in Image.ID:
+        factory, accept = Image.OPEN[fmt]
+        result = not accept or accept(prefix)
+        if not result or isinstance(result, str):
+            continue
+        fp.seek(0)
+        try:
+            return factory(fp, "")
+        except (SyntaxError, IndexError, TypeError, struct.error):
+            continue
+    raise UnidentifiedImageError("формат не распознан")
+
+
+class OverBudget(Exception):
+    """Изображение не помещается в бюджет памяти и не может быть декодировано уменьшенным."""
+
+
+def estimate_bytes(header: ImageHeader, reduce: int = 1) -> int:
+    """
+    Оценка памяти на обработку: декодированный кадр плюс RGB-результат.
+    """
+    pixels = (header.width // reduce) * (header.height // reduce)
+    per_pixel = _MODE_BYTES.get(header.mode, Image.getmodebands(header.mode))
+    return pixels * (per_pixel + 3)
+
+
+def plan_decode(header: ImageHeader, budget_bytes: int) -> int:
+    """
+    Во сколько раз уменьшать при декодировании, чтобы уложиться в бюджет (1 — без уменьшения).
+    :raises OverBudget: если уменьшение невозможно или недостаточно
+    """
+    need = estimate_bytes(header)
+    if need <= budget_bytes:
+        return 1
+    if header.format == "JPEG":
+        for reduce in REDUCE_FACTORS:
+            if estimate_bytes(header, reduce) <= budget_bytes:
+                return reduce
+    raise OverBudget(
+        f"{header.width}×{header.height} {header.mode}: нужно ~{need / (1024 * 1024):.0f} МБ, "
+        f"бюджет {budget_bytes / (1024 * 1024):.0f} МБ"
+    )
+
+
+def server_budget_mb() -> int:
+    """Бюджет памяти сервера в МБ, общий для всех заданий; 0 — без ограничения."""
+    value = os.environ.get(MEMORY_BUDGET_ENV, "").strip()
+    return int(value) if value else MEMORY_BUDGET_MB
+
+
+def budget_bytes(budget_mb: Optional[int]) -> Optional[int]:
+    return budget_mb * 1024 * 1024 if budget_mb else None
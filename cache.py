@@ -0,0 +1,44 @@
+# cache.py
+"""Небольшой потокобезопасный LRU-кэш в памяти процесса."""
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Ограниченный по числу элементов LRU-кэш со счётчиками попаданий.
+    Живёт на уровне модуля, поэтому переживает перезапуски скрипта Streamlit.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_create(self, key, factory):
+        """Возвращает значение по ключу, при промахе создаёт его через factory()."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        # Создание может быть долгим — выполняем вне блокировки
+        value = factory()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,153 @@
+# cli.py
+"""
+Пакетная обработка из командной строки, без браузера и Streamlit.
+
+Примеры:
+    python cli.py rename  photos/ -o renamed.zip
+    python cli.py convert upload.zip -o converted.zip --workers 8 --profile web
+    python cli.py convert photos/ -o web.zip --profile web --format avif --effort fast
+    python cli.py watermark photos/ -o out.zip --watermark watermarks/logo.png --position bottom_right --opacity 0.6 --scale 0.25
+    python cli.py pipeline upload.zip -o out.zip --watermark watermarks/logo.png --profile web
+    python cli.py convert photos/ -o out.zip --volume-mb 2000    # out.part1.zip, out.part2.zip…
+    python cli.py convert photos/ -o out.zip --volume-mb 2000 --upload-url https://files.example/upload
+"""
+import argparse
+import sys
+
+from archive import DEFAULT_VOLUME_MB
+from budget import MEMORY_BUDGET_MB, budget_bytes, set_decode_budget
+from colorspace import DEFAULT_INTENT, INTENTS
+from encoders import DEFAULT_EFFORT, DEFAULT_FORMAT, DEFAULT_PROFILE, ENCODER_EFFORTS, OUTPUT_FORMATS, PROFILES, format_available
+from engine import run_convert, run_pipeline, run_rename, run_watermark
+from heif import INSTALL_HINT, heif_available
+from ingest import DUPLICATES_FANOUT, DUPLICATES_SKIP, iter_paths
+from parallel import default_workers
+from result_cache import CACHE_ROOT, MAX_CACHE_MB, ResultCache
+from sinks import UPLOAD_CHUNK_MB, UPLOAD_RETRIES, HttpUploadSink, LocalDirSink, SinkUploader
+
+POSITIONS = ["bottom_right", "bottom_left", "top_right", "top_left", "center"]
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="PhotoFlow: пакетная обработка изображений")
+    parser.add_argument("mode", choices=["rename", "convert", "watermark", "pipeline"], help="режим обработки")
+    parser.add_argument("inputs", nargs="+", help="папки, ZIP-архивы или отдельные изображения")
+    parser.add_argument("-o", "--output", required=True, help="путь к ZIP-архиву результата")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="число процессов (по умолчанию — все ядра)")
+    parser.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE, help="профиль JPEG-кодировщика")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default=DEFAULT_FORMAT,
+                        help="convert: формат результата (webp/avif — если поддерживает Pillow)")
+    parser.add_argument("--effort", choices=list(ENCODER_EFFORTS), default=DEFAULT_EFFORT,
+                        help="convert: скорость кодирования WebP/AVIF")
+    parser.add_argument("--watermark", help="PNG/JPG водяного знака (режим watermark; в pipeline необязателен)")
+    parser.add_argument("--no-rename", action="store_true", help="pipeline: не нумеровать файлы по папкам")
+    parser.add_argument("--position", choices=POSITIONS, default="bottom_right")
+    parser.add_argument("--opacity", type=float, default=0.6, help="прозрачность 0.0-1.0")
+    parser.add_argument("--scale", type=float, default=0.25, help="ширина знака относительно ширины фото, 0.0-1.0")
+    parser.add_argument("--srgb", nargs="?", const=DEFAULT_INTENT, choices=list(INTENTS),
+                        help=f"перевести в sRGB по ICC-профилю (цель рендеринга, по умолчанию {DEFAULT_INTENT})")
+    parser.add_argument("--memory-budget", type=int, default=MEMORY_BUDGET_MB,
+                        help="бюджет памяти на декодирование в МБ (0 — без ограничения)")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="не класть в архив точные дубликаты (по умолчанию им копируется результат)")
+    parser.add_argument("--volume-mb", type=int, default=DEFAULT_VOLUME_MB,
+                        help="разбить результат на тома <имя>.partN.zip не больше N МБ (0 — один архив)")
+    parser.add_argument("--copy-to", metavar="DIR", help="скопировать готовые тома в папку")
+    parser.add_argument("--upload-url", help="загрузить готовые тома на HTTP-сервер (протокол — в sinks.py)")
+    parser.add_argument("--upload-chunk-mb", type=int, default=UPLOAD_CHUNK_MB, help="размер части загрузки в МБ")
+    parser.add_argument("--upload-retries", type=int, default=UPLOAD_RETRIES, help="число повторов при ошибках загрузки")
+    parser.add_argument("--no-cache", action="store_true", help="не использовать кэш обработанных изображений")
+    parser.add_argument("--cache-dir", default=CACHE_ROOT, help="папка кэша обработанных изображений")
+    parser.add_argument("--cache-mb", type=int, default=MAX_CACHE_MB, help="предельный размер кэша в МБ")
+    parser.add_argument("-q", "--quiet", action="store_true", help="не выводить прогресс")
+    return parser
+
+
+def _print_progress(done, total, text):
+    end = "\n" if done == total else ""
+    print(f"\r{text}", end=end, file=sys.stderr, flush=True)
+
+
+def _print_volume(path):
+    print(f"\nТом готов: {path}", file=sys.stderr, flush=True)
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.mode == "watermark" and not args.watermark:
+        print("Для режима watermark нужен --watermark", file=sys.stderr)
+        return 2
+    if not format_available(args.format):
+        print(f"Формат {args.format} не поддерживается установленным Pillow", file=sys.stderr)
+        return 2
+    if not heif_available():
+        print(INSTALL_HINT, file=sys.stderr)
+    # Процесс консольного запуска один на задание: допущенные бюджетом изображения декодируются без предела Pillow
+    set_decode_budget(budget_bytes(args.memory_budget))
+    log = []
+    sources = list(iter_paths(args.inputs, log))
+    progress = None if args.quiet else _print_progress
+    cache = None if args.no_cache else ResultCache(args.cache_dir, args.cache_mb)
+    duplicates = DUPLICATES_SKIP if args.skip_duplicates else DUPLICATES_FANOUT
+    if args.upload_url:
+        sink = HttpUploadSink(args.upload_url, chunk_mb=args.upload_chunk_mb, retries=args.upload_retries)
+    elif args.copy_to:
+        sink = LocalDirSink(args.copy_to)
+    else:
+        sink = None
+    # Тома отправляются в фоне, пока пишутся следующие
+    uploader = SinkUploader(sink, log) if sink else None
+
+    def on_volume(path):
+        if not args.quiet:
+            _print_volume(path)
+        if uploader:
+            uploader.submit(path)
+
+    if args.mode == "rename":
+        result = run_rename(sources, args.output, log, progress=progress, duplicates=duplicates,
+                            volume_mb=args.volume_mb, on_volume=on_volume)
+    elif args.mode == "convert":
+        result = run_convert(sources, args.output, log, workers=args.workers, profile=args.profile, progress=progress, cache=cache,
+                             memory_budget_mb=args.memory_budget, duplicates=duplicates,
+                             volume_mb=args.volume_mb, on_volume=on_volume, srgb=args.srgb,
+                             output=args.format, effort=args.effort)
+    elif args.mode == "pipeline":
+        result = run_pipeline(
+            sources, args.output, args.watermark,
+            position=args.position, opacity=args.opacity, scale=args.scale, rename=not args.no_rename,
+            log=log, workers=args.workers, profile=args.profile, progress=progress, cache=cache,
+            memory_budget_mb=args.memory_budget, duplicates=duplicates,
+            volume_mb=args.volume_mb, on_volume=on_volume, srgb=args.srgb,
+        )
+    else:
+        result = run_watermark(
+            sources, args.output, args.watermark,
+            position=args.position, opacity=args.opacity, scale=args.scale,
+            log=log, workers=args.workers, profile=args.profile, progress=progress, cache=cache,
+            memory_budget_mb=args.memory_budget, duplicates=duplicates,
+            volume_mb=args.volume_mb, on_volume=on_volume, srgb=args.srgb,
+        )
+    if uploader:
+        uploader.finish(result.volumes)
+    if not sources:
+        print("Не найдено ни одного поддерживаемого изображения.", file=sys.stderr)
+    if result.error is not None:
+        print(f"Ошибка при архивации: {result.error}", file=sys.stderr)
+        return 1
+    print(", ".join(f"{key}: {value}" for key, value in result.stats.items()))
+    if len(result.volumes) > 1:
+        print("Тома: " + ", ".join(result.volumes))
+    if uploader:
+        for d in uploader.deliveries:
+            if d.error is None:
+                print(f"Отправлен: {d.location}")
+            else:
+                print(f"Не удалось отправить {d.name}: {d.error}", file=sys.stderr)
+        if uploader.failed:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
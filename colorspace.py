@@ -0,0 +1,85 @@
+# colorspace.py
+"""
+Преобразование в sRGB по ICC-профилю источника (ImageCms).
+
+Построение преобразования (разбор профилей и расчёт таблиц) намного дороже
+его применения, а в пакете обычно один-два разных профиля, поэтому готовые
+преобразования кэшируются в памяти процесса по sha256 профиля, режиму
+изображения и цели рендеринга. В пуле у каждого процесса свой кэш.
+"""
+import hashlib
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageCms
+
+from cache import LRUCache
+
+INTENTS = {
+    "perceptual": ImageCms.Intent.PERCEPTUAL,
+    "relative": ImageCms.Intent.RELATIVE_COLORIMETRIC,
+    "saturation": ImageCms.Intent.SATURATION,
+    "absolute": ImageCms.Intent.ABSOLUTE_COLORIMETRIC,
+}
+INTENT_LABELS = {
+    "perceptual": "Перцептивное (фото)",
+    "relative": "Относительное колориметрическое",
+    "saturation": "Насыщенность (графика)",
+    "absolute": "Абсолютное колориметрическое",
+}
+DEFAULT_INTENT = "perceptual"
+
+# Режимы, для которых строится преобразование; остальные сначала приводятся к RGB
+_CMS_MODES = ("RGB", "CMYK", "L")
+
+_transform_cache = LRUCache(maxsize=16)    # (sha256 профиля, режим, intent) -> преобразование или None
+_srgb_profile = None
+_srgb_bytes = None
+
+
+def _srgb():
+    global _srgb_profile, _srgb_bytes
+    if _srgb_profile is None:
+        _srgb_profile = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB"))
+        _srgb_bytes = _srgb_profile.tobytes()
+    return _srgb_profile
+
+
+def srgb_icc() -> bytes:
+    """ICC-профиль sRGB для записи в результат вместо профиля источника."""
+    _srgb()
+    return _srgb_bytes
+
+
+def _build(icc: bytes, mode: str, intent: str):
+    try:
+        source = ImageCms.ImageCmsProfile(BytesIO(icc))
+        return ImageCms.buildTransform(source, _srgb(), mode, "RGB", renderingIntent=INTENTS[intent])
+    except (ImageCms.PyCMSError, OSError, ValueError):
+        # Битый или несовместимый с режимом профиль: запоминаем, чтобы не разбирать его снова
+        return None
+
+
+def to_srgb(img: Image.Image, intent: str = DEFAULT_INTENT, counts: Dict[str, int] = None) -> Tuple[Image.Image, Optional[bytes]]:
+    """
+    Переводит изображение в sRGB (режим RGB).
+    Без ICC-профиля или с непригодным профилем — обычное convert("RGB") и профиль
+    источника как есть, то есть то же, что без управления цветом.
+    :param counts: Сюда добавляются icc_transform_hits / icc_transform_misses / icc_errors
+    :return: (изображение, ICC-профиль для записи в результат)
+    """
+    counts = counts if counts is not None else {}
+    icc = img.info.get("icc_profile")
+    if not icc:
+        return img.convert("RGB"), None
+    if img.mode not in _CMS_MODES:
+        img = img.convert("L" if img.mode in ("LA", "I", "I;16") else "RGB")
+    key = (hashlib.sha256(icc).hexdigest(), img.mode, intent)
+    built = []
+    transform = _transform_cache.get_or_create(key, lambda: built.append(1) or _build(icc, img.mode, intent))
+    name = "icc_transform_misses" if built else "icc_transform_hits"
+    counts[name] = counts.get(name, 0) + 1
+    if transform is None:
+        counts["icc_errors"] = counts.get("icc_errors", 0) + 1
+        return img.convert("RGB"), icc
+    return ImageCms.applyTransform(img, transform), srgb_icc()
@@ -0,0 +1,81 @@
+# downloads.py
+"""
+Скачивание архивов-результатов из браузера.
+
+st.download_button не умеет отдавать файл с диска: при нажатии всё, что
+вернул data, кладётся в память сервера (MemoryMediaFileStorage), и каждое
+повторное нажатие — ещё одна копия до следующего перезапуска страницы.
+Поэтому при запуске через app.py (streamlit run app.py, st.App) результат
+отдаётся отдельным маршрутом /download/<токен>: FileResponse читает файл
+с диска частями, и в памяти сервера архив не оказывается. Токен случайный,
+выдаётся сессии вместе со ссылкой и действует, пока файл лежит в хранилище
+результатов (results.py).
+
+При запуске streamlit run Recon2.py маршрута нет, и остаётся download_button:
+архив при скачивании целиком читается в память. Чтобы в памяти был один том,
+а не весь результат, большие задания по умолчанию делятся на тома
+(browser_volume_mb).
+"""
+import os
+import secrets
+import threading
+
+DOWNLOAD_ROUTE = "/download"
+LARGE_JOB_MB = 500              # задание с загрузками больше — «большое»
+LARGE_JOB_VOLUME_MB = 200       # размер тома большого задания без маршрута скачивания
+
+_links = {}                     # токен -> (путь, имя файла)
+_tokens = {}                    # путь -> токен
+_lock = threading.Lock()
+_served = False
+
+
+def routes() -> list:
+    """Маршрут скачивания для st.App (см. app.py)."""
+    global _served
+    from starlette.exceptions import HTTPException
+    from starlette.responses import FileResponse
+    from starlette.routing import Route
+
+    async def download(request):
+        with _lock:
+            link = _links.get(request.path_params["token"])
+        if link is None or not os.path.isfile(link[0]):
+            raise HTTPException(status_code=404, detail="Файл не найден или уже удалён")
+        path, file_name = link
+        return FileResponse(path, media_type="application/zip", filename=file_name)
+
+    _served = True
+    return [Route(DOWNLOAD_ROUTE + "/{token}", download, methods=["GET"])]
+
+
+def served() -> bool:
+    """Запущено ли приложение с маршрутом скачивания (app.py)."""
+    return _served
+
+
+def download_url(path: str, file_name: str) -> str:
+    """Ссылка на файл результата; для одного файла токен один и тот же между перезапусками страницы."""
+    path = os.path.abspath(path)
+    with _lock:
+        # Ссылки на удалённые результаты больше не нужны
+        for token, (old_path, _) in list(_links.items()):
+            if not os.path.isfile(old_path):
+                del _links[token]
+                _tokens.pop(old_path, None)
+        token = _tokens.get(path)
+        if token is None:
+            token = _tokens[path] = secrets.token_urlsafe(24)
+        _links[token] = (path, file_name)
+    return f"{DOWNLOAD_ROUTE}/{token}"
+
+
+def browser_volume_mb(volume_mb: int, input_bytes: int) -> int:
+    """
+    Размер тома для задания, результат которого скачивается в браузере. Без маршрута
+    скачивания большое задание (загрузки больше LARGE_JOB_MB) делится на тома
+    по LARGE_JOB_VOLUME_MB, если размер тома не задан меньше.
+    """
+    if _served or input_bytes <= LARGE_JOB_MB * 1024 * 1024:
+        return volume_mb
+    return min(volume_mb, LARGE_JOB_VOLUME_MB) if volume_mb else LARGE_JOB_VOLUME_MB
@@ -0,0 +1,158 @@
+# encoders.py
+"""
+Профили кодировщика для конвертации и водяного знака и форматы результата.
+
+JPEG доступен всегда, WebP и AVIF — если Pillow собран с libwebp/libavif.
+Качество и сохранение ICC/EXIF берутся из профиля для любого формата;
+скорость кодирования WebP/AVIF задаётся отдельно (ENCODER_EFFORTS).
+"""
+import time
+from io import BytesIO
+from typing import List, NamedTuple, Optional, Tuple
+from PIL import Image, features
+
+
+class EncoderProfile(NamedTuple):
+    name: str
+    label: str           # подпись в интерфейсе
+    quality: int
+    subsampling: int     # 0 = 4:4:4, 1 = 4:2:2, 2 = 4:2:0
+    optimize: bool
+    progressive: bool
+    keep_icc: bool       # сохранять ICC-профиль источника
+    keep_exif: bool      # сохранять EXIF источника
+
+
+PROFILES = {
+    "archival": EncoderProfile("archival", "Архивный (максимальное качество)", 100, 0, True, True, True, True),
+    "web": EncoderProfile("web", "Для веба (быстрее, меньше размер)", 85, 2, False, False, True, False),
+    "fast": EncoderProfile("fast", "Черновой (самый быстрый)", 75, 2, False, False, False, False),
+}
+DEFAULT_PROFILE = "archival"
+
+
+class OutputFormat(NamedTuple):
+    name: str
+    label: str           # подпись в интерфейсе
+    title: str           # название в сообщениях и именах архивов
+    pil_format: str      # имя формата для Image.save
+    suffix: str          # расширение файлов в архиве
+    feature: Optional[str]   # модуль Pillow, без которого формат недоступен (PIL.features)
+
+
+OUTPUT_FORMATS = {
+    "jpeg": OutputFormat("jpeg", "JPEG", "JPEG", "JPEG", ".jpg", None),
+    "webp": OutputFormat("webp", "WebP (меньше размер)", "WebP", "WEBP", ".webp", "webp"),
+    "avif": OutputFormat("avif", "AVIF (самый компактный, медленнее)", "AVIF", "AVIF", ".avif", "avif"),
+}
+DEFAULT_FORMAT = "jpeg"
+
+# Скорость кодирования: (method WebP 0…6 — больше значит медленнее и компактнее,
+# speed AVIF 0…10 — больше значит быстрее). На JPEG не влияет.
+ENCODER_EFFORTS = {
+    "fast": (2, 8),
+    "balanced": (4, 6),
+    "best": (6, 4),
+}
+EFFORT_LABELS = {
+    "fast": "Быстро",
+    "balanced": "Сбалансированно",
+    "best": "Максимальное сжатие (медленно)",
+}
+DEFAULT_EFFORT = "balanced"
+
+_AVIF_SUBSAMPLING = {0: "4:4:4", 1: "4:2:2", 2: "4:2:0"}
+
+
+def get_profile(profile) -> EncoderProfile:
+    """Принимает имя профиля или сам EncoderProfile."""
+    if isinstance(profile, EncoderProfile):
+        return profile
+    try:
+        return PROFILES[profile]
+    except KeyError:
+        raise ValueError(f"Неизвестный профиль кодирования: {profile}")
+
+
+def format_available(name: str) -> bool:
+    fmt = OUTPUT_FORMATS.get(name)
+    if fmt is None:
+        return False
+    if fmt.feature is None:
+        return True
+    # Модуль, неизвестный старому Pillow (AVIF появился в 11.2), проверяется как отсутствующий
+    return bool(features.check(fmt.feature))
+
+
+def available_formats() -> List[str]:
+    """Форматы результата, которые поддерживает установленный Pillow."""
+    return [name for name in OUTPUT_FORMATS if format_available(name)]
+
+
+def get_format(name) -> OutputFormat:
+    """Принимает имя формата или сам OutputFormat."""
+    fmt = name if isinstance(name, OutputFormat) else OUTPUT_FORMATS.get(name)
+    if fmt is None:
+        raise ValueError(f"Неизвестный формат результата: {name}")
+    if not format_available(fmt.name):
+        raise ValueError(f"Формат {fmt.title} не поддерживается установленным Pillow")
+    return fmt
+
+
+def encode_jpeg(img: Image.Image, profile, icc_profile=None, exif=None) -> Tuple[bytes, float]:
+    """
+    Кодирует RGB-изображение в JPEG по профилю.
+    :param icc_profile: ICC-профиль источника (записывается, если профиль это разрешает)
+    :param exif: EXIF источника (записывается, если профиль это разрешает)
+    :return: (байты JPEG, время кодирования в секундах)
+    """
+    profile = get_profile(profile)
+    params = {
+        "quality": profile.quality,
+        "subsampling": profile.subsampling,
+        "optimize": profile.optimize,
+        "progressive": profile.progressive,
+    }
+    if profile.keep_icc and icc_profile:
+        params["icc_profile"] = icc_profile
+    if profile.keep_exif and exif:
+        params["exif"] = exif
+    start = time.perf_counter()
+    buf = BytesIO()
+    img.save(buf, "JPEG", **params)
+    return buf.getvalue(), time.perf_counter() - start
+
+
+def encode_image(img: Image.Image, profile, output=DEFAULT_FORMAT, effort: str = DEFAULT_EFFORT, threads: int = 1,
+                 icc_profile=None, exif=None) -> Tuple[bytes, float]:
+    """
+    Кодирует RGB-изображение в выбранный формат по профилю.
+    :param output: Формат результата (OUTPUT_FORMATS)
+    :param effort: Скорость кодирования WebP/AVIF (ENCODER_EFFORTS)
+    :param threads: Потоков кодировщика AVIF на одно изображение; libwebp через Pillow однопоточен
+    :return: (байты результата, время кодирования в секундах)
+    """
+    fmt = get_format(output)
+    if fmt.name == "jpeg":
+        return encode_jpeg(img, profile, icc_profile=icc_profile, exif=exif)
+    profile = get_profile(profile)
+    method, speed = ENCODER_EFFORTS[effort]
+    params = {"quality": profile.quality}
+    if fmt.name == "webp":
+        params["method"] = method
+    else:
+        params.update(speed=speed, max_threads=max(1, threads), subsampling=_AVIF_SUBSAMPLING[profile.subsampling])
+    if profile.keep_icc and icc_profile:
+        params["icc_profile"] = icc_profile
+    if profile.keep_exif and exif:
+        params["exif"] = exif
+    start = time.perf_counter()
+    buf = BytesIO()
+    img.save(buf, fmt.pil_format, **params)
+    return buf.getvalue(), time.perf_counter() - start
+
+
+def format_size(num_bytes: int) -> str:
+    if num_bytes >= 1024 * 1024:
+        return f"{num_bytes / (1024 * 1024):.1f} МБ"
+    return f"{num_bytes / 1024:.0f} КБ"
@@ -0,0 +1,569 @@
+# engine.py
+"""
+Пакетная обработка без Streamlit: переименование, конвертация, водяной знак
+и конвейер из всех трёх шагов за один проход.
+
+Функции run_* принимают список ImageSource (см. ingest.py), пишут результат
+в ZIP по указанному пути (или в тома <имя>.partN.zip, см. archive.VolumeWriter)
+и сообщают о ходе работы через callback progress(done, total, text).
+Их используют и интерфейс (Recon2.py), и командная строка (cli.py).
+"""
+import shutil
+import time
+from collections import defaultdict
+from typing import Callable, List, NamedTuple, Optional
+
+from archive import DEFAULT_VOLUME_MB, VolumeWriter, volume_bytes
+from budget import MEMORY_BUDGET_MB, OverBudget, budget_bytes, estimate_bytes
+from encoders import DEFAULT_EFFORT, DEFAULT_FORMAT, DEFAULT_PROFILE, format_size, get_format, get_profile
+from imaging import convert_image, watermark_digest, watermark_image
+from ingest import DUPLICATES_FANOUT, DUPLICATES_SKIP, find_duplicates, strip_common_root, unique_path
+from metrics import JobMetrics
+from parallel import PoolLane, Precomputed, default_workers, ordered_map
+from prescan import EtaTracker, UnreadableImage, format_eta, prescan
+from result_cache import ResultCache
+
+ProgressCallback = Callable[[int, int, str], None]
+PROGRESS_INTERVAL = 0.25        # секунд между обновлениями прогресса
+
+
+class JobResult(NamedTuple):
+    stats: dict
+    log: List[str]
+    outputs: list                  # пути файлов внутри архива результата
+    error: Optional[Exception]     # ошибка архивации, если архив пришлось пересоздать только с логом
+    metrics: JobMetrics            # замеры по этапам (сохраняются в архив как metrics.json)
+    volumes: tuple = ()            # пути томов архива результата (один, если разбиение выключено)
+
+
+def _noop(*args):
+    pass
+
+
+def throttle_progress(progress: ProgressCallback, interval: float = PROGRESS_INTERVAL) -> ProgressCallback:
+    """
+    Пропускает обновления чаще, чем раз в interval секунд, кроме первого и последнего:
+    при десятках тысяч файлов число обновлений не зависит от размера пакета.
+    """
+    if progress is None or progress is _noop:
+        return _noop
+    last = [float("-inf")]
+
+    def throttled(done, total, text):
+        now = time.monotonic()
+        if done >= total or now - last[0] >= interval:
+            last[0] = now
+            progress(done, total, text)
+    return throttled
+
+
+def _write_log_only(result_zip: str, log: List[str], metrics: JobMetrics):
+    metrics.finish()
+    with VolumeWriter(result_zip, log=log) as writer:
+        writer.finish(metrics)
+
+
+def plan_renames(sources):
+    """
+    Планирует нумерацию 1.jpg, 2.jpg… по папкам без обращения к диску.
+    Возвращает список (source, новый путь или None, если файл пропущен) и лог.
+    Повторяет прежнее поведение: если целевое имя уже занято другим файлом
+    папки, файл остаётся под своим именем.
+    """
+    by_folder = defaultdict(list)
+    for src in sources:
+        by_folder[src.path.parent].append(src)
+    plan = []
+    log = []
+    for folder in sorted(by_folder):
+        photos_sorted = sorted(by_folder[folder], key=lambda s: s.path.name)
+        names = {s.path.name for s in photos_sorted}
+        for idx, src in enumerate(photos_sorted, 1):
+            new_path = folder / f"{idx}{src.path.suffix.lower()}"
+            if new_path.name in names and new_path.name != src.path.name:
+                log.append(f"Пропущено: Файл '{new_path}' уже существует.")
+                plan.append((src, None))
+            else:
+                names.discard(src.path.name)
+                names.add(new_path.name)
+                log.append(f"Переименовано: '{src.path}' -> '{new_path}'")
+                plan.append((src, new_path))
+    return plan, log
+
+
+def run_rename(
+    sources,
+    result_zip: str,
+    log: List[str] = None,
+    progress: ProgressCallback = None,
+    metrics: JobMetrics = None,
+    duplicates: str = DUPLICATES_FANOUT,
+    volume_mb: int = DEFAULT_VOLUME_MB,
+    on_volume: Callable[[str], None] = None,
+) -> JobResult:
+    """
+    Нумерует файлы по папкам и пишет их в архив без перекодирования.
+    :param duplicates: DUPLICATES_SKIP — точные дубликаты не попадают в архив;
+        иначе они нумеруются как обычные файлы (копирование и так без перекодирования)
+    :param volume_mb: Размер тома архива в МБ; 0 — один архив
+    :param on_volume: Вызывается с путём каждого готового тома, пока задание продолжается
+    """
+    log = log if log is not None else []
+    progress = throttle_progress(progress)
+    metrics = metrics or JobMetrics("rename")
+    if not sources:
+        _write_log_only(result_zip, log, metrics)
+        return JobResult({"total": 0, "renamed": 0, "skipped": 0, "errors": 0, "duplicates": 0}, log, [], None, metrics, (result_zip,))
+    total = len(sources)
+    groups = find_duplicates(sources)
+    n_duplicates = total - len(groups)
+    if n_duplicates:
+        metrics.count("duplicates", n_duplicates)
+        log.append(f"🔁 Дубликатов: {n_duplicates}")
+        if duplicates == DUPLICATES_SKIP:
+            for src, dups in groups:
+                for dup in dups:
+                    log.append(f"⏭️ Дубликат пропущен: {dup.path} (совпадает с {src.path})")
+            sources = [src for src, _ in groups]
+    plan, plan_log = plan_renames(sources)
+    log.extend(plan_log)
+    renamed = sum(1 for _, new_path in plan if new_path is not None)
+    stats = {"total": total, "renamed": renamed, "skipped": len(plan) - renamed, "errors": 0, "duplicates": n_duplicates}
+    # Пропущенные файлы попадают в архив под исходным именем
+    out_paths = []
+    taken = set()
+    for (src, _), path in zip(plan, strip_common_root([new_path or src.path for src, new_path in plan])):
+        path = _free_path(path, taken, src, log)
+        taken.add(str(path))
+        out_paths.append(path)
+    outputs = []
+    try:
+        with VolumeWriter(result_zip, volume_bytes(volume_mb), log, on_volume) as writer:
+            for i, ((src, new_path), arcname) in enumerate(zip(plan, out_paths), 1):
+                start = time.perf_counter()
+                try:
+                    if src.zip_info is not None:
+                        # Члены архива (в том числе зашифрованные) переносятся как есть: без распаковки и повторного сжатия
+                        writer.copy_raw(src.zip_file, src.zip_info, str(arcname))
+                    else:
+                        with src.open() as fsrc, writer.open(str(arcname), src.size) as fdst:
+                            shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+                except Exception as e:
+                    # Один нечитаемый файл не останавливает задание
+                    log.append(f"❌ Не удалось скопировать {src.path}: {e}")
+                    metrics.add_file(arcname, src.size, 0, {}, ok=False)
+                    stats["errors"] += 1
+                    if new_path is not None:
+                        stats["renamed"] -= 1
+                else:
+                    metrics.add_file(arcname, src.size, src.size, {"archive": time.perf_counter() - start})
+                    outputs.append(arcname)
+                progress(i, len(plan), f"Обработано файлов: {i}/{len(plan)}")
+            metrics.finish()
+            volumes = writer.finish(metrics)
+    except Exception as e:
+        log.append(f"Ошибка архивации: {e}")
+        _write_log_only(result_zip, log, metrics)
+        return JobResult(stats, log, [], e, metrics, (result_zip,))
+    return JobResult(stats, log, outputs, None, metrics, tuple(volumes))
+
+
+class _TransformResult(NamedTuple):
+    outputs: list
+    errors: int
+    skipped: int          # не поместились в бюджет памяти
+    duplicates: int       # точные дубликаты других входных файлов
+    error: Optional[Exception]
+    volumes: tuple
+
+
+def _run_transform(fn, extra_args: tuple, cache_params: tuple, sources, result_zip, log, *,
+                   workers, progress, on_error, error_text, timed, metrics, cache, memory_budget_mb,
+                   duplicates, volume_mb, on_volume, pool=None, out_path=None) -> _TransformResult:
+    """
+    Общий цикл конвертации и водяного знака: пул процессов → архив.
+    fn вызывается как fn(исходные байты, *extra_args[, reduce]); cache_params — всё,
+    от чего зависит результат, кроме самих байтов (ключ кэша результатов).
+    Каждый уникальный файл обрабатывается один раз; результат копируется
+    под путями его дубликатов или дубликаты пропускаются (duplicates).
+    out_path(src) задаёт путь результата в архиве (по умолчанию — исходный путь с .jpg).
+    """
+    out_path = out_path or (lambda src: src.path.with_suffix('.jpg'))
+    outputs = []
+    errors = 0
+    skipped = 0
+    groups = find_duplicates(sources)
+    copies_of = {id(src): dups for src, dups in groups if dups}
+    unique = [src for src, _ in groups]
+    n_duplicates = len(sources) - len(unique)
+    saved = 0.0
+    done = 0
+    ingest_times = {}
+    cache_keys = {}
+    costs = {}
+    hits = misses = 0
+    written = {}        # имя в архиве -> id первого вхождения, чей результат там записан
+    budget = budget_bytes(memory_budget_mb)
+
+    # Заголовки всех файлов читаются заранее: нечитаемые пропускаются сразу, сумма мегапикселей даёт оценку времени
+    progress(0, len(sources), "Проверка заголовков файлов...")
+    with metrics.span("prescan"):
+        scan = prescan(unique, budget)
+    metrics.count("prescan_bad", scan.bad)
+    eta = EtaTracker(scan.megapixels, metrics.mode)
+    summary = (f"🔎 Заголовки: файлов {len(unique)}, {scan.megapixels:.1f} Мпикс, с ICC-профилем {scan.with_icc}, "
+               f"нечитаемых {scan.bad}, не помещаются в бюджет памяти {scan.over_budget} "
+               f"(время: {scan.elapsed:.2f} сек)")
+    if eta.remaining() is not None:
+        summary += f", ожидаемое время обработки {format_eta(eta.remaining())}"
+    log.append(summary)
+
+    def progress_text():
+        remaining = eta.remaining()
+        suffix = f", осталось {format_eta(remaining)}" if remaining is not None else ""
+        return f"Обработано файлов: {done}/{len(sources)}{suffix}"
+
+    def make_args(src):
+        # Чтение исходных байтов (в том числе распаковка члена ZIP), заголовок и хэширование — этап ingest
+        start = time.perf_counter()
+        try:
+            entry = scan.get(src)
+            if entry.error:
+                # Заголовок не читается: файл не читается и не отправляется в пул
+                raise UnreadableImage(entry.error)
+            if entry.over_budget:
+                # Бюджет проверен по заголовку: файл не читается целиком
+                raise OverBudget(entry.over_budget)
+            data = src.read_bytes()
+            args, params = (data,) + extra_args, cache_params
+            if budget:
+                header, reduce = entry.header, entry.reduce
+                costs[id(src)] = estimate_bytes(header, reduce)
+                if reduce > 1:
+                    log.append(f"⚠️ {src.path}: {header.width}×{header.height} не помещается в бюджет памяти, "
+                               f"декодируется с уменьшением 1/{reduce}")
+                    args, params = args + (reduce,), params + (("reduce", reduce),)
+            if cache is not None:
+                key = cache.make_key(data, params)
+                cached = cache.get(key)
+                if cached is not None:
+                    return Precomputed((cached, {}, None, {}))
+                cache_keys[id(src)] = key
+            return args
+        finally:
+            ingest_times[id(src)] = time.perf_counter() - start
+
+    try:
+        # Результаты пишутся сразу в архив, без промежуточных файлов
+        with VolumeWriter(result_zip, volume_bytes(volume_mb), log, on_volume) as writer:
+            # Обработка идёт в пуле процессов, результаты — в порядке подачи
+            # Задачи допускаются в пул, пока оценка памяти в работе не превышает бюджет
+            tasks = ordered_map(fn, unique, make_args, workers=workers,
+                                budget=budget, cost=lambda src: costs.pop(id(src), 0), pool=pool)
+            for res in tasks:
+                rel_path = res.item.path
+                out_rel = out_path(res.item)
+                spans = {"ingest": ingest_times.pop(id(res.item), 0.0)}
+                cache_key = cache_keys.pop(id(res.item), None)
+                elapsed = f"время: {res.elapsed:.2f} сек, " if timed else ""
+                if res.error is None:
+                    data, worker_spans, peak_mb, worker_counts = res.value
+                    spans.update(worker_spans)
+                    for name, n in worker_counts.items():
+                        metrics.count(name, n)
+                    out_rel = _free_path(out_rel, written, res.item, log)
+                    start = time.perf_counter()
+                    writer.writestr(str(out_rel), data)
+                    written[str(out_rel)] = id(res.item)
+                    spans["archive"] = time.perf_counter() - start
+                    outputs.append(out_rel)
+                    metrics.add_file(out_rel, res.item.size, len(data), spans, peak_mb)
+                    if cache is not None and cache_key is None:
+                        hits += 1
+                        log.append(f"♻️ {rel_path} → {out_rel} (из кэша, {format_size(len(data))})")
+                    else:
+                        if cache_key is not None:
+                            misses += 1
+                            cache.put(cache_key, data)
+                        log.append(f"✅ {rel_path} → {out_rel} ({elapsed}кодирование: {spans['encode']:.2f} сек, {format_size(len(data))})")
+                elif isinstance(res.error, UnreadableImage):
+                    metrics.add_file(rel_path, res.item.size, 0, spans, ok=False)
+                    log.append(f"❌ {rel_path}: заголовок не читается, файл пропущен без обработки ({res.error})")
+                    on_error(f"Файл {rel_path} повреждён или не является изображением: {res.error}")
+                    errors += 1
+                elif isinstance(res.error, OverBudget):
+                    metrics.add_file(rel_path, res.item.size, 0, spans, ok=False)
+                    log.append(f"⏭️ Пропущено: {rel_path} — не помещается в бюджет памяти ({res.error})")
+                    skipped += 1
+                else:
+                    metrics.add_file(rel_path, res.item.size, 0, spans, ok=False)
+                    suffix = f" (время: {res.elapsed:.2f} сек)" if timed else ""
+                    log.append(f"❌ {rel_path}: {error_text} ({res.error}){suffix}")
+                    on_error(f"Ошибка при обработке {rel_path}: {res.error}")
+                    errors += 1
+                done += 1
+                eta.add(scan.get(res.item).megapixels)
+                progress(done, len(sources), progress_text())
+                for dup in copies_of.get(id(res.item), ()):
+                    # Дубликат не читается и не декодируется: его судьба та же, что у первого вхождения
+                    saved += spans["ingest"] + res.elapsed
+                    dup_out = out_path(dup)
+                    if res.error is not None:
+                        metrics.add_file(dup.path, dup.size, 0, {}, ok=False)
+                        log.append(f"❌ {dup.path}: дубликат {rel_path}, {error_text} ({res.error})")
+                        if isinstance(res.error, OverBudget):
+                            skipped += 1
+                        else:
+                            errors += 1
+                    elif duplicates == DUPLICATES_SKIP:
+                        log.append(f"⏭️ Дубликат пропущен: {dup.path} (совпадает с {rel_path})")
+                    elif written.get(str(dup_out)) == id(res.item):
+                        # Тот же файл под тем же путём (перекрывающиеся архивы): второй записи с этим именем не будет
+                        log.append(f"⏭️ Дубликат {dup.path}: {dup_out} уже есть в архиве (совпадает с {rel_path}), "
+                                   f"повторно не записан")
+                    else:
+                        dup_out = _free_path(dup_out, written, dup, log)
+                        start = time.perf_counter()
+                        writer.writestr(str(dup_out), data)
+                        written[str(dup_out)] = id(res.item)
+                        metrics.add_file(dup_out, dup.size, len(data), {"archive": time.perf_counter() - start})
+                        outputs.append(dup_out)
+                        log.append(f"📎 {dup.path} → {dup_out} (дубликат {rel_path}, результат скопирован)")
+                    done += 1
+                    progress(done, len(sources), progress_text())
+            eta.finish()
+            if cache is not None:
+                metrics.count("result_cache_hits", hits)
+                metrics.count("result_cache_misses", misses)
+                log.append(f"♻️ Кэш результатов: попаданий {hits}, промахов {misses}")
+            icc_built = metrics.counters.get("icc_transform_misses", 0)
+            icc_total = icc_built + metrics.counters.get("icc_transform_hits", 0)
+            if icc_total:
+                log.append(f"🎨 sRGB: преобразований {icc_total}, построено {icc_built} "
+                           f"(попаданий в кэш {100 * (icc_total - icc_built) / icc_total:.0f}%), "
+                           f"время {metrics.stage_totals.get('color', 0.0):.2f} сек")
+            size_in, size_out = metrics.output_bytes()
+            if size_in:
+                log.append(f"📉 Размер: исходники {format_size(size_in)} → результат {format_size(size_out)} "
+                           f"({100 * size_out / size_in:.0f}% от исходного)")
+            if n_duplicates:
+                metrics.count("duplicates", n_duplicates)
+                log.append(f"🔁 Дубликатов: {n_duplicates}, обработка не повторялась (сэкономлено ~{saved:.1f} сек)")
+            # Добавляем лог и замеры всегда
+            metrics.finish()
+            volumes = writer.finish(metrics)
+    except Exception as e:
+        log.append(f"Ошибка архивации: {e}")
+        _write_log_only(result_zip, log, metrics)
+        return _TransformResult(outputs, errors, skipped, n_duplicates, e, (result_zip,))
+    return _TransformResult(outputs, errors, skipped, n_duplicates, None, tuple(volumes))
+
+
+def _free_path(path, written, src, log: List[str]):
+    """Путь в архиве для src; занятый другим файлом путь заменяется свободным (см. ingest.unique_path)."""
+    free = unique_path(path, written, src.archive)
+    if free != path:
+        origin = f" из {src.archive}" if src.archive else ""
+        log.append(f"⚠️ {src.path}{origin}: путь {path} уже занят другим файлом, записан как {free}")
+    return free
+
+
+def _srgb_params(srgb: Optional[str]) -> tuple:
+    # Без управления цветом ключ кэша результатов прежний
+    return (("srgb", srgb),) if srgb else ()
+
+
+def _format_params(output, effort: str) -> tuple:
+    # Для JPEG ключ кэша результатов прежний; скорость влияет на байты WebP/AVIF
+    fmt = get_format(output)
+    return (("format", fmt.name, effort),) if fmt.name != "jpeg" else ()
+
+
+def encoder_threads(workers: int) -> int:
+    """Потоков кодировщика на изображение: ядра делятся между процессами пула."""
+    return max(1, default_workers() // max(1, workers))
+
+
+def plan_numbering(sources, suffix: str = ".jpg") -> dict:
+    """
+    Нумерация 1.jpg, 2.jpg… по папкам для конвейера: id(source) -> путь в архиве.
+    Архив результата новый, поэтому конфликтов с существующими именами нет
+    и номер каждого файла не зависит от успеха обработки остальных.
+    """
+    by_folder = defaultdict(list)
+    for src in sources:
+        by_folder[src.path.parent].append(src)
+    planned = []
+    for folder in sorted(by_folder):
+        for idx, src in enumerate(sorted(by_folder[folder], key=lambda s: s.path.name), 1):
+            planned.append((src, folder / f"{idx}{suffix}"))
+    out_paths = strip_common_root([path for _, path in planned])
+    return {id(src): path for (src, _), path in zip(planned, out_paths)}
+
+
+def run_convert(
+    sources,
+    result_zip: str,
+    log: List[str] = None,
+    workers: int = 1,
+    profile=DEFAULT_PROFILE,
+    progress: ProgressCallback = None,
+    on_error: Callable[[str], None] = None,
+    metrics: JobMetrics = None,
+    cache: ResultCache = None,
+    memory_budget_mb: int = MEMORY_BUDGET_MB,
+    duplicates: str = DUPLICATES_FANOUT,
+    volume_mb: int = DEFAULT_VOLUME_MB,
+    on_volume: Callable[[str], None] = None,
+    srgb: str = None,
+    output: str = DEFAULT_FORMAT,
+    effort: str = DEFAULT_EFFORT,
+    pool: PoolLane = None,
+) -> JobResult:
+    """
+    Конвертирует все изображения в JPEG, WebP или AVIF по профилю кодировщика.
+    Архивные имена получают расширение формата (.jpg, .webp, .avif).
+    :param output: Формат результата (encoders.OUTPUT_FORMATS); недоступный в Pillow — ValueError
+    :param effort: Скорость кодирования WebP/AVIF (encoders.ENCODER_EFFORTS)
+    :param srgb: Перевод в sRGB по ICC-профилю с этой целью рендеринга (colorspace.INTENTS); None — без него
+    :param cache: Кэш результатов; None — без кэширования
+    :param memory_budget_mb: Бюджет памяти на декодирование в работе; 0/None — без ограничения
+    :param duplicates: DUPLICATES_FANOUT — копировать результат дубликатам, DUPLICATES_SKIP — пропускать их
+    :param volume_mb: Размер тома архива в МБ; 0 — один архив
+    :param on_volume: Вызывается с путём каждого готового тома, пока задание продолжается
+    :param pool: Очередь в общем пуле процессов (parallel.shared_pool().lane); None — свой пул на задание
+    """
+    log = log if log is not None else []
+    metrics = metrics or JobMetrics("convert")
+    fmt = get_format(output)
+    if not sources:
+        _write_log_only(result_zip, log, metrics)
+        return JobResult({"total": 0, "converted": 0, "errors": 0, "skipped": 0, "duplicates": 0, "format": fmt.name},
+                         log, [], None, metrics, (result_zip,))
+    res = _run_transform(
+        convert_image,
+        (profile, srgb, fmt.name, effort, encoder_threads(workers)),
+        ("convert", tuple(get_profile(profile))) + _srgb_params(srgb) + _format_params(fmt, effort),
+        sources, result_zip, log,
+        workers=workers, progress=throttle_progress(progress), on_error=on_error or _noop,
+        error_text="ошибка конвертации", timed=False, metrics=metrics, cache=cache,
+        memory_budget_mb=memory_budget_mb, duplicates=duplicates,
+        volume_mb=volume_mb, on_volume=on_volume, pool=pool, out_path=lambda src: src.path.with_suffix(fmt.suffix),
+    )
+    stats = {"total": len(sources), "converted": len(res.outputs), "errors": res.errors, "skipped": res.skipped,
+             "duplicates": res.duplicates, "format": fmt.name}
+    return JobResult(stats, log, res.outputs, res.error, metrics, res.volumes)
+
+
+def run_watermark(
+    sources,
+    result_zip: str,
+    watermark,
+    position: str = "bottom_right",
+    opacity: float = 0.5,
+    scale: float = 0.25,
+    log: List[str] = None,
+    workers: int = 1,
+    profile=DEFAULT_PROFILE,
+    progress: ProgressCallback = None,
+    on_error: Callable[[str], None] = None,
+    metrics: JobMetrics = None,
+    cache: ResultCache = None,
+    memory_budget_mb: int = MEMORY_BUDGET_MB,
+    duplicates: str = DUPLICATES_FANOUT,
+    volume_mb: int = DEFAULT_VOLUME_MB,
+    on_volume: Callable[[str], None] = None,
+    srgb: str = None,
+    pool: PoolLane = None,
+) -> JobResult:
+    """
+    Накладывает водяной знак на все изображения.
+    :param watermark: Путь к PNG/JPG знаку (передаётся в процессы пула)
+    :param srgb: Перевод в sRGB перед наложением знака (см. run_convert)
+    :param cache: Кэш результатов; None — без кэширования
+    :param memory_budget_mb: Бюджет памяти на декодирование в работе; 0/None — без ограничения
+    :param duplicates: DUPLICATES_FANOUT — копировать результат дубликатам, DUPLICATES_SKIP — пропускать их
+    :param volume_mb: Размер тома архива в МБ; 0 — один архив
+    :param on_volume: Вызывается с путём каждого готового тома, пока задание продолжается
+    :param pool: Очередь в общем пуле процессов (parallel.shared_pool().lane); None — свой пул на задание
+    """
+    log = log if log is not None else []
+    metrics = metrics or JobMetrics("watermark")
+    if not sources:
+        _write_log_only(result_zip, log, metrics)
+        return JobResult({"total": 0, "processed": 0, "errors": 0, "skipped": 0, "duplicates": 0}, log, [], None, metrics, (result_zip,))
+    cache_params = ("watermark", watermark_digest(watermark), position, opacity, scale, tuple(get_profile(profile))) + _srgb_params(srgb)
+    res = _run_transform(
+        watermark_image,
+        (watermark, position, opacity, scale, profile, srgb),
+        cache_params,
+        sources, result_zip, log,
+        workers=workers, progress=throttle_progress(progress), on_error=on_error or _noop,
+        error_text="ошибка обработки водяного знака", timed=True, metrics=metrics, cache=cache,
+        memory_budget_mb=memory_budget_mb, duplicates=duplicates,
+        volume_mb=volume_mb, on_volume=on_volume, pool=pool,
+    )
+    stats = {"total": len(sources), "processed": len(res.outputs), "errors": res.errors, "skipped": res.skipped, "duplicates": res.duplicates}
+    return JobResult(stats, log, res.outputs, res.error, metrics, res.volumes)
+
+
+def run_pipeline(
+    sources,
+    result_zip: str,
+    watermark=None,
+    position: str = "bottom_right",
+    opacity: float = 0.5,
+    scale: float = 0.25,
+    rename: bool = True,
+    log: List[str] = None,
+    workers: int = 1,
+    profile=DEFAULT_PROFILE,
+    progress: ProgressCallback = None,
+    on_error: Callable[[str], None] = None,
+    metrics: JobMetrics = None,
+    cache: ResultCache = None,
+    memory_budget_mb: int = MEMORY_BUDGET_MB,
+    duplicates: str = DUPLICATES_FANOUT,
+    volume_mb: int = DEFAULT_VOLUME_MB,
+    on_volume: Callable[[str], None] = None,
+    srgb: str = None,
+    pool: PoolLane = None,
+) -> JobResult:
+    """
+    Конвейер за один проход: конвертация в JPEG, водяной знак (если задан)
+    и нумерация по папкам. Каждое изображение декодируется и кодируется
+    один раз и сразу пишется в архив под итоговым именем.
+    :param watermark: Путь к знаку или None — без водяного знака
+    :param rename: Нумеровать файлы 1.jpg, 2.jpg… по папкам (см. plan_numbering)
+    Остальные параметры — как у run_convert и run_watermark.
+    """
+    log = log if log is not None else []
+    metrics = metrics or JobMetrics("pipeline")
+    if not sources:
+        _write_log_only(result_zip, log, metrics)
+        return JobResult({"total": 0, "processed": 0, "errors": 0, "skipped": 0, "duplicates": 0}, log, [], None, metrics, (result_zip,))
+    steps = ["конвертация"] + (["водяной знак"] if watermark else []) + (["нумерация"] if rename else [])
+    log.append(f"🔗 Конвейер: {' → '.join(steps)}")
+    if watermark:
+        # Результат тот же, что у режима водяного знака: общий ключ кэша
+        fn, extra_args = watermark_image, (watermark, position, opacity, scale, profile, srgb)
+        cache_params = ("watermark", watermark_digest(watermark), position, opacity, scale, tuple(get_profile(profile))) + _srgb_params(srgb)
+    else:
+        fn, extra_args = convert_image, (profile, srgb, DEFAULT_FORMAT, DEFAULT_EFFORT, 1)
+        cache_params = ("convert", tuple(get_profile(profile))) + _srgb_params(srgb)
+    out_path = None
+    if rename:
+        numbering = plan_numbering(sources)
+        out_path = lambda src: numbering[id(src)]
+    res = _run_transform(
+        fn,
+        extra_args,
+        cache_params,
+        sources, result_zip, log,
+        workers=workers, progress=throttle_progress(progress), on_error=on_error or _noop,
+        error_text="ошибка обработки", timed=True, metrics=metrics, cache=cache,
+        memory_budget_mb=memory_budget_mb, duplicates=duplicates,
+        volume_mb=volume_mb, on_volume=on_volume, pool=pool, out_path=out_path,
+    )
+    stats = {"total": len(sources), "processed": len(res.outputs), "errors": res.errors, "skipped": res.skipped, "duplicates": res.duplicates}
+    return JobResult(stats, log, res.outputs, res.error, metrics, res.volumes)
@@ -0,0 +1,36 @@
+# heif.py
+"""
+Поддержка HEIC/HEIF через pillow_heif.
+
+Пакет импортируется только при первом декодировании, а не при старте
+приложения, и регистрируется в Pillow ровно один раз на процесс
+(процессы пула, созданные через fork, наследуют регистрацию).
+Без pillow_heif остальные форматы работают как обычно.
+"""
+import importlib.util
+import threading
+
+INSTALL_HINT = "Для поддержки HEIC/HEIF установите пакет pillow-heif: pip install pillow-heif"
+
+_lock = threading.Lock()
+_registered = None
+
+
+def heif_available() -> bool:
+    """Установлен ли pillow_heif (без импорта пакета)."""
+    return importlib.util.find_spec("pillow_heif") is not None
+
+
+def register_heif() -> bool:
+    """Регистрирует открыватель HEIC/HEIF, если это ещё не сделано. False — пакета нет."""
+    global _registered
+    if _registered is None:
+        with _lock:
+            if _registered is None:
+                try:
+                    import pillow_heif
+                    pillow_heif.register_heif_opener()
+                    _registered = True
+                except ImportError:
+                    _registered = False
+    return _registered
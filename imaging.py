@@ -0,0 +1,241 @@
+# imaging.py
+"""
+Операции над одним изображением: подготовка и наложение водяного знака,
+конвертация и кодирование. Модуль не зависит от Streamlit, функции
+convert_image и watermark_image выполняются и в процессах пула.
+"""
+from io import BytesIO
+import hashlib
+import os
+from PIL import Image
+from budget import admitted_decode
+from cache import LRUCache
+from colorspace import to_srgb
+from encoders import DEFAULT_EFFORT, DEFAULT_FORMAT, DEFAULT_PROFILE, encode_image, encode_jpeg
+from heif import register_heif
+from metrics import StageTimer, peak_rss_mb
+
+
+class PreparedWatermark:
+    """
+    Водяной знак, уже масштабированный под нужную ширину и с применённой прозрачностью.
+    Готовится один раз на пакет (фото с одной камеры имеют одинаковую ширину).
+    """
+
+    def __init__(self, image: Image.Image, digest: str, width: int, opacity: float):
+        self.image = image
+        self.digest = digest
+        self.width = width
+        self.opacity = opacity
+
+
+# Кэши уровня процесса: общие для обработки пакетов и предпросмотра в Recon2.py
+_digest_cache = LRUCache(maxsize=64)    # (путь, mtime, размер) -> sha256 файла
+_source_cache = LRUCache(maxsize=8)     # sha256 -> исходный знак в RGBA
+_prepared_cache = LRUCache(maxsize=16)  # (sha256, ширина, прозрачность) -> PreparedWatermark
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def watermark_digest(source) -> str:
+    """sha256 содержимого водяного знака: путь, bytes или BytesIO."""
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    if isinstance(source, BytesIO):
+        return hashlib.sha256(source.getvalue()).hexdigest()
+    path = os.path.abspath(source)
+    stat = os.stat(path)
+    # Для файлов на диске хэш пересчитывается только при изменении файла
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    return _digest_cache.get_or_create(key, lambda: _hash_file(path))
+
+
+def _load_watermark(source) -> Image.Image:
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    if isinstance(source, BytesIO):
+        source.seek(0)
+    wm = Image.open(source).convert("RGBA")
+    wm.load()
+    return wm
+
+
+def prepare_watermark(source, width: int, opacity: float) -> PreparedWatermark:
+    """
+    Возвращает подготовленный водяной знак из LRU-кэша по ключу
+    (хэш файла знака, целевая ширина, прозрачность).
+    :param source: Путь к PNG/JPG, bytes или BytesIO
+    :param width: Ширина водяного знака в пикселях
+    :param opacity: Прозрачность (0.0-1.0)
+    """
+    digest = watermark_digest(source)
+
+    def build():
+        wm = _source_cache.get_or_create(digest, lambda: _load_watermark(source))
+        # Масштабирование
+        wm_ratio = width / wm.width
+        wm_height = int(wm.height * wm_ratio)
+        wm = wm.resize((width, wm_height), Image.Resampling.LANCZOS)
+        # Применение прозрачности
+        if opacity < 1.0:
+            alpha = wm.getchannel("A").point(lambda p: int(p * opacity))
+            wm.putalpha(alpha)
+        return PreparedWatermark(wm, digest, width, opacity)
+
+    return _prepared_cache.get_or_create((digest, width, opacity), build)
+
+
+def apply_watermark(
+    base_image: Image.Image,
+    watermark_path=None,
+    position: str = "bottom_right",
+    opacity: float = 0.5,
+    scale: float = 0.2,
+    watermark: PreparedWatermark = None,
+    inplace: bool = False,
+) -> Image.Image:
+    """
+    Накладывает PNG-водяной знак на изображение.
+    :param base_image: Исходное изображение (PIL.Image)
+    :param watermark_path: Путь к PNG-водяному знаку (или BytesIO, или bytes)
+    :param position: Позиция ('top_left', 'top_right', 'center', 'bottom_left', 'bottom_right')
+    :param opacity: Прозрачность (0.0-1.0)
+    :param scale: Масштаб водяного знака относительно ширины base_image (0.0-1.0)
+    :param watermark: Уже подготовленный знак (PreparedWatermark); если задан,
+        watermark_path, opacity и scale не используются
+    :param inplace: Разрешает изменить base_image, если оно уже в RGB (без копии кадра)
+    :return: Новое изображение с водяным знаком
+    """
+    if watermark is None:
+        if not watermark_path:
+            raise ValueError("Не указан водяной знак")
+        watermark = prepare_watermark(watermark_path, int(base_image.width * scale), opacity)
+    wm = watermark.image
+    width, height = base_image.size
+    # Позиционирование
+    positions = {
+        "top_left": (0, 0),
+        "top_right": (width - wm.width, 0),
+        "center": ((width - wm.width) // 2, (height - wm.height) // 2),
+        "bottom_left": (0, height - wm.height),
+        "bottom_right": (width - wm.width, height - wm.height),
+    }
+    pos = positions.get(position, positions["bottom_right"])
+    if _has_alpha(base_image) or pos[0] < 0 or pos[1] < 0:
+        # Прозрачный фон или знак больше фото: смешивание по всему кадру в RGBA
+        out = base_image.convert("RGBA")
+        out.alpha_composite(wm, dest=pos)
+        return out.convert("RGB")
+    # Непрозрачный фон: в RGBA переводится только область под знаком, остальные пиксели не трогаются
+    if base_image.mode == "RGB":
+        out = base_image if inplace else base_image.copy()
+    else:
+        out = base_image.convert("RGB")
+    box = (pos[0], pos[1], pos[0] + wm.width, pos[1] + wm.height)
+    region = out.crop(box).convert("RGBA")
+    region.alpha_composite(wm)
+    out.paste(region.convert("RGB"), box)
+    return out
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA", "La", "RGBa") or (img.mode == "P" and "transparency" in img.info)
+
+
+PREVIEW_MAX_SIDE = 1024
+_preview_cache = LRUCache(maxsize=8)    # ключ содержимого загрузки -> уменьшенная копия для предпросмотра
+
+
+def load_preview_image(fp, max_side: int = PREVIEW_MAX_SIDE) -> Image.Image:
+    """
+    Декодирует изображение сразу в уменьшенном виде: для JPEG через draft
+    (масштабирование при декодировании 1/2…1/8), для остальных через thumbnail.
+    """
+    register_heif()
+    img = Image.open(fp)
+    img.draft(None, (max_side, max_side))
+    img.load()
+    img.thumbnail((max_side, max_side))
+    return img
+
+
+def get_preview_image(key, opener, max_side: int = PREVIEW_MAX_SIDE) -> Image.Image:
+    """
+    Уменьшенная копия из кэша по ключу содержимого; opener() вызывается только при промахе.
+    """
+    def build():
+        with opener() as fp:
+            return load_preview_image(fp, max_side)
+    return _preview_cache.get_or_create(key, build)
+
+
+def _decode(data: bytes, reduce: int = 1) -> Image.Image:
+    register_heif()
+    # Размер уже проверен бюджетом памяти (budget.plan_decode); предел Pillow снимается только в процессах пула
+    with admitted_decode():
+        img = Image.open(BytesIO(data))
+    if reduce > 1:
+        # Уменьшение при декодировании (JPEG): полный кадр в памяти не создаётся
+        img.draft(None, (img.width // reduce, img.height // reduce))
+    img.load()
+    return img
+
+
+def watermark_image(data: bytes, watermark_path, position: str, opacity: float, scale: float, profile=DEFAULT_PROFILE,
+                    srgb: str = None, reduce: int = 1):
+    """
+    Декодирует исходные байты, накладывает знак и возвращает JPEG по профилю кодировщика.
+    Выполняется и в процессах пула: у каждого процесса свой кэш подготовленных знаков.
+    :param srgb: Цель рендеринга для перевода в sRGB (см. colorspace.INTENTS); None — без управления цветом
+    :param reduce: Уменьшение при декодировании (см. budget.plan_decode)
+    :return: (байты JPEG, время по этапам decode/color/transform/encode, пик RSS процесса в МБ,
+        счётчики кэша ICC-преобразований)
+    """
+    timer = StageTimer()
+    counts = {}
+    with timer.span("decode"):
+        img = _decode(data, reduce)
+    icc_profile = img.info.get('icc_profile')
+    exif = img.info.get('exif')
+    if srgb:
+        with timer.span("color"):
+            img, icc_profile = to_srgb(img, srgb, counts)
+    with timer.span("transform"):
+        processed_img = apply_watermark(img, watermark_path=watermark_path, position=position, opacity=opacity, scale=scale, inplace=True)
+    out, timer.spans["encode"] = encode_jpeg(processed_img, profile, icc_profile=icc_profile, exif=exif)
+    return out, timer.spans, peak_rss_mb(), counts
+
+
+def convert_image(data: bytes, profile=DEFAULT_PROFILE, srgb: str = None, output: str = DEFAULT_FORMAT,
+                  effort: str = DEFAULT_EFFORT, threads: int = 1, reduce: int = 1):
+    """
+    Декодирует исходные байты и возвращает JPEG, WebP или AVIF по профилю кодировщика.
+    Выполняется и в процессах пула.
+    :param srgb: Цель рендеринга для перевода в sRGB (см. colorspace.INTENTS); None — без управления цветом
+    :param output: Формат результата (см. encoders.OUTPUT_FORMATS)
+    :param effort: Скорость кодирования WebP/AVIF (см. encoders.ENCODER_EFFORTS)
+    :param threads: Потоков кодировщика на изображение (AVIF)
+    :param reduce: Уменьшение при декодировании (см. budget.plan_decode)
+    :return: (байты результата, время по этапам decode/color/transform/encode, пик RSS процесса в МБ,
+        счётчики кэша ICC-преобразований)
+    """
+    timer = StageTimer()
+    counts = {}
+    with timer.span("decode"):
+        img = _decode(data, reduce)
+    icc_profile = img.info.get('icc_profile')
+    exif = img.info.get('exif')
+    if srgb:
+        with timer.span("color"):
+            img, icc_profile = to_srgb(img, srgb, counts)
+    else:
+        with timer.span("transform"):
+            img = img.convert("RGB")
+    out, timer.spans["encode"] = encode_image(img, profile, output, effort, threads, icc_profile=icc_profile, exif=exif)
+    return out, timer.spans, peak_rss_mb(), counts
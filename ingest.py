@@ -0,0 +1,425 @@
+# ingest.py
+"""
+Общий слой приёма входных файлов для всех режимов.
+
+Архивы не распаковываются на диск: члены ZIP читаются лениво через
+ZipFile.infolist(), а режимы получают записи ImageSource и сами решают,
+когда открыть поток с данными. Загрузки из браузера читаются прямо из памяти;
+на диск сбрасываются только очень крупные (см. detach_uploads). Точные дубликаты (перекрывающиеся архивы)
+находятся по размеру и CRC32 и подтверждаются SHA-256 — см. find_duplicates.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import defaultdict
+from pathlib import PurePosixPath
+from typing import Callable, IO, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+SUPPORTED_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff', '.heic', '.heif')
+
+
+class ImageSource(NamedTuple):
+    """Одно входное изображение: отдельный файл или член ZIP-архива."""
+    archive: Optional[str]           # имя архива или None для отдельного файла
+    path: PurePosixPath              # относительный путь (внутри архива или имя файла)
+    open: Callable[[], IO[bytes]]    # открывает поток с исходными байтами
+    size: int                        # размер исходных данных в байтах
+    zip_file: Optional[zipfile.ZipFile] = None   # архив-источник (для копирования без распаковки)
+    zip_info: Optional[zipfile.ZipInfo] = None   # запись центрального каталога
+
+    def read_bytes(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+
+def safe_member_path(name: str) -> Optional[PurePosixPath]:
+    """
+    Нормализует имя члена архива так же, как ZipFile.extract:
+    убирает абсолютные пути и компоненты '.'/'..'. Возвращает None для пустых имён.
+    """
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    if not parts:
+        return None
+    return PurePosixPath(*parts)
+
+
+def is_supported(name: str) -> bool:
+    return name.lower().endswith(SUPPORTED_EXTS)
+
+
+class _UploadReader:
+    """Поток для отдельного загруженного файла, не закрывающий сам upload."""
+
+    def __init__(self, uploaded):
+        self._uploaded = uploaded
+        self._uploaded.seek(0)
+
+    def read(self, size=-1):
+        return self._uploaded.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._uploaded.seek(offset, whence)
+
+    def tell(self):
+        return self._uploaded.tell()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class UploadBuffer:
+    """
+    Независимый поток поверх памяти загруженного файла, без копирования байтов.
+    Фоновое задание читает свою копию позиции, поэтому интерфейс может
+    одновременно работать с тем же upload (например, строить предпросмотр).
+    """
+
+    def __init__(self, uploaded):
+        self.name = uploaded.name
+        self._buf = uploaded.getbuffer()
+        self._pos = 0
+
+    @property
+    def size(self) -> int:
+        return len(self._buf)
+
+    def reopen(self) -> "UploadBuffer":
+        """Ещё один поток по той же памяти, со своей позицией."""
+        view = object.__new__(UploadBuffer)
+        view.name, view._buf, view._pos = self.name, self._buf, 0
+        return view
+
+    def read(self, size=-1):
+        end = len(self._buf) if size is None or size < 0 else min(self._pos + size, len(self._buf))
+        data = bytes(self._buf[self._pos:end])
+        self._pos = max(end, self._pos)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += len(self._buf)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def getbuffer(self):
+        return self._buf
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SpilledUpload:
+    """
+    Загрузка, сброшенная во временный файл: задание читает её с диска
+    и не удерживает память загрузки. Файл удаляется, когда на него
+    больше не ссылается ни один поток (обычно — по завершении задания).
+    """
+
+    def __init__(self, uploaded, spill_dir: str = None):
+        self.name = uploaded.name
+        self._file = tempfile.TemporaryFile(prefix="photoflow_upload_", dir=spill_dir)
+        self._file.write(uploaded.getbuffer())
+        self._file.flush()
+        self._size = self._file.tell()
+        self._lock = threading.Lock()   # один файл на все потоки, у каждого своя позиция
+        self._pos = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def reopen(self) -> "SpilledUpload":
+        view = object.__new__(SpilledUpload)
+        view.name, view._file, view._size, view._lock, view._pos = self.name, self._file, self._size, self._lock, 0
+        return view
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self._size - self._pos
+        with self._lock:
+            self._file.seek(self._pos)
+            data = self._file.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+SPILL_THRESHOLD_MB = 256        # загрузки крупнее задание читает с диска
+
+
+def detach_uploads(uploaded_files, threshold_mb: int = SPILL_THRESHOLD_MB, memory_budget_mb: int = None,
+                   spill_dir: str = None) -> list:
+    """
+    Снимки загрузок для обработки в другом потоке.
+    Обычно это UploadBuffer: изображения декодируются прямо из памяти загрузки,
+    без записи во временную папку. На диск (SpilledUpload) сбрасываются загрузки
+    больше threshold_mb, а также самые крупные из остальных, пока удерживаемые
+    в памяти загрузки занимают больше половины бюджета памяти memory_budget_mb.
+    :param threshold_mb: 0 — не сбрасывать по размеру
+    :param spill_dir: Папка для временных файлов (по умолчанию системная)
+    """
+    sizes = [len(uploaded.getbuffer()) for uploaded in uploaded_files]
+    limit = threshold_mb * 1024 * 1024 if threshold_mb else None
+    spill = {i for i, size in enumerate(sizes) if limit and size > limit}
+    if memory_budget_mb:
+        # Бюджет делится между загрузками, которые держит задание, и декодированием
+        headroom = memory_budget_mb * 1024 * 1024 // 2
+        in_memory = sum(size for i, size in enumerate(sizes) if i not in spill)
+        for i in sorted(set(range(len(sizes))) - spill, key=lambda i: -sizes[i]):
+            if in_memory <= headroom:
+                break
+            spill.add(i)
+            in_memory -= sizes[i]
+    return [
+        SpilledUpload(uploaded, spill_dir) if i in spill else UploadBuffer(uploaded)
+        for i, uploaded in enumerate(uploaded_files)
+    ]
+
+
+def _upload_size(uploaded) -> int:
+    uploaded.seek(0, 2)
+    size = uploaded.tell()
+    uploaded.seek(0)
+    return size
+
+
+def iter_archive(uploaded, log: List[str], name: str = None) -> Iterator[ImageSource]:
+    """
+    Лениво перечисляет поддерживаемые изображения в ZIP.
+    :param uploaded: Загруженный файл Streamlit или любой открытый двоичный файл
+    :param name: Имя архива для лога (по умолчанию uploaded.name)
+    """
+    name = name or uploaded.name
+    uploaded.seek(0)
+    try:
+        # ZipFile держит ссылку на upload и не закрывает его: источники
+        # можно открывать и после того, как генератор исчерпан.
+        zf = zipfile.ZipFile(uploaded, "r")
+        members = [
+            info for info in zf.infolist()
+            if not info.is_dir() and is_supported(info.filename)
+        ]
+    except Exception as e:
+        log.append(f"❌ Ошибка открытия архива {name}: {e}")
+        return
+    log.append(f"📦 Архив {name}: найдено {len(members)} изображений.")
+    for info in members:
+        path = safe_member_path(info.filename)
+        if path is None:
+            log.append(f"❌ Не удалось извлечь {info.filename} из {name}: некорректное имя")
+            continue
+        yield ImageSource(name, path, lambda info=info: zf.open(info), info.file_size, zf, info)
+
+
+def iter_sources(uploaded_files: Iterable, log: List[str]) -> Iterator[ImageSource]:
+    """
+    Единая точка приёма: перечисляет изображения из всех загрузок по порядку.
+    Каждый архив просматривается ровно один раз, без повторного обхода диска.
+    """
+    for uploaded in uploaded_files:
+        name = uploaded.name
+        if isinstance(uploaded, SpilledUpload):
+            log.append(f"💾 {name}: {uploaded.size / (1024 * 1024):.0f} МБ, читается с диска.")
+        if name.lower().endswith(".zip"):
+            yield from iter_archive(uploaded, log)
+        elif is_supported(name):
+            log.append(f"🖼️ Файл {name}: добавлен.")
+            if hasattr(uploaded, "reopen"):
+                # Снимок загрузки (detach_uploads): у каждого чтения свой поток по тем же байтам
+                opener, size = uploaded.reopen, uploaded.size
+            else:
+                opener, size = (lambda uploaded=uploaded: _UploadReader(uploaded)), _upload_size(uploaded)
+            yield ImageSource(None, PurePosixPath(safe_member_path(name) or name), opener, size)
+        else:
+            log.append(f"❌ {name}: не поддерживается.")
+
+
+def iter_paths(paths: Iterable[str], log: List[str]) -> Iterator[ImageSource]:
+    """
+    Приём с локального диска (для CLI): папки обходятся рекурсивно,
+    ZIP-архивы читаются так же лениво, как загрузки, отдельные файлы — как есть.
+    Пути внутри папки считаются относительно неё.
+    """
+    for raw in paths:
+        root = os.path.abspath(raw)
+        if os.path.isdir(root):
+            files = []
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if is_supported(filename):
+                        files.append(os.path.join(dirpath, filename))
+            log.append(f"📁 Папка {raw}: найдено {len(files)} изображений.")
+            for full in files:
+                rel = PurePosixPath(*os.path.relpath(full, root).split(os.sep))
+                yield ImageSource(None, rel, lambda full=full: open(full, "rb"), os.path.getsize(full))
+        elif root.lower().endswith(".zip"):
+            # Файл остаётся открытым, пока на него ссылаются источники
+            yield from iter_archive(open(root, "rb"), log, name=os.path.basename(root))
+        elif is_supported(root):
+            log.append(f"🖼️ Файл {os.path.basename(root)}: добавлен.")
+            yield ImageSource(
+                None,
+                PurePosixPath(os.path.basename(root)),
+                lambda root=root: open(root, "rb"),
+                os.path.getsize(root),
+            )
+        else:
+            log.append(f"❌ {raw}: не поддерживается.")
+
+
+def strip_common_root(paths: List[PurePosixPath]) -> List[PurePosixPath]:
+    """
+    Если все пути лежат в одной общей папке верхнего уровня, убирает её —
+    так же, как раньше результат архивировался от единственной распакованной папки.
+    """
+    if not paths or any(len(p.parts) < 2 for p in paths):
+        return paths
+    roots = {p.parts[0] for p in paths}
+    if len(roots) != 1:
+        return paths
+    return [PurePosixPath(*p.parts[1:]) for p in paths]
+
+
+def unique_path(path: PurePosixPath, taken, archive: str = None) -> PurePosixPath:
+    """
+    Путь в архиве результата, не совпадающий с уже занятыми (taken — строки).
+    Одинаковые пути из разных архивов разводятся по папкам с именами архивов
+    (b.zip: root/a.jpg -> b/root/a.jpg); если и так занято — суффикс « (2)», « (3)»…
+    """
+    if str(path) not in taken:
+        return path
+    if archive:
+        path = PurePosixPath(PurePosixPath(archive).stem) / path
+        if str(path) not in taken:
+            return path
+    n = 2
+    while True:
+        candidate = path.with_name(f"{path.stem} ({n}){path.suffix}")
+        if str(candidate) not in taken:
+            return candidate
+        n += 1
+
+
+DUPLICATES_FANOUT = "fanout"    # дубликат получает копию результата под своим путём
+DUPLICATES_SKIP = "skip"        # дубликат пропускается с записью в лог
+
+
+def _content_crc(src: ImageSource) -> int:
+    """CRC32 содержимого: для членов ZIP — из центрального каталога, без чтения данных."""
+    if src.zip_info is not None:
+        return src.zip_info.CRC
+    crc = 0
+    with src.open() as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def _content_sha256(src: ImageSource) -> bytes:
+    digest = hashlib.sha256()
+    with src.open() as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def find_duplicates(sources: List[ImageSource]) -> List[Tuple[ImageSource, List[ImageSource]]]:
+    """
+    Группирует точные дубликаты по размеру и CRC32 содержимого.
+    Отдельные файлы читаются для подсчёта CRC, только если их размер
+    совпал с размером другого источника. Совпадение размера и CRC32 — только
+    кандидат (CRC32 легко совпадает у разных файлов): дубликат подтверждается
+    SHA-256, для которого читаются лишь такие кандидаты.
+    :return: Список (первое вхождение, его дубликаты) в порядке подачи
+    """
+    by_size = defaultdict(list)
+    for src in sources:
+        by_size[src.size].append(src)
+    primary_of = {}
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+        by_crc = defaultdict(list)
+        for src in same_size:
+            try:
+                by_crc[_content_crc(src)].append(src)
+            except Exception:
+                continue    # ошибка чтения проявится при обработке
+        for candidates in by_crc.values():
+            if len(candidates) < 2:
+                continue
+            first_by_digest = {}
+            for src in candidates:
+                try:
+                    digest = _content_sha256(src)
+                except Exception:
+                    continue
+                primary_of[id(src)] = first_by_digest.setdefault(digest, src)
+    groups = []
+    index = {}
+    for src in sources:
+        primary = primary_of.get(id(src), src)
+        if primary is src:
+            index[id(src)] = len(groups)
+            groups.append((src, []))
+        else:
+            groups[index[id(primary)]][1].append(src)
+    return groups
@@ -0,0 +1,169 @@
+# job_view.py
+"""
+Интерфейс фоновых заданий: запуск из режимов, опрос прогресса и перенос
+результата в session_state. Идентификатор задания хранится в session_state
+и в адресе страницы (?job=…), поэтому после перезагрузки интерфейс
+снова подключается к работающему или уже готовому заданию.
+"""
+import os
+import time
+import streamlit as st
+from downloads import download_url, served
+from joblog import LOG_PAGE_LINES
+from jobs import QUEUED as JOB_QUEUED, default_runner
+from results import make_handle, new_job_dir
+from sinks import DONE, FAILED, QUEUED, SENDING
+
+DELIVERY_STATUS = {QUEUED: "в очереди на отправку", SENDING: "отправляется", DONE: "отправлен", FAILED: "ошибка отправки"}
+
+POLL_SECONDS = 1.0
+DEBUG = os.environ.get("PHOTOFLOW_DEBUG") == "1"     # отладочные сообщения в интерфейсе
+
+
+def debug(message: str):
+    if DEBUG:
+        st.write(f"[DEBUG] {message}")
+
+
+def new_result_dir() -> str:
+    """Папка для результата нового задания; папки ещё идущих заданий очистка не трогает."""
+    return new_job_dir(st.session_state["session_id"], keep=default_runner().active_dirs())
+
+
+def submit_job(mode, result_path, target):
+    """Ставит задание в фоновую очередь и перезапускает скрипт, чтобы показать прогресс."""
+    job = default_runner().submit(st.session_state["session_id"], mode, target, result_path)
+    st.session_state["job_id"] = job.id
+    st.query_params["job"] = job.id
+    st.rerun()
+
+
+def attach_job():
+    """
+    Вызывается до инициализации session_id: после перезагрузки страницы
+    восстанавливает задание и сессию по адресу.
+    """
+    if "job_id" in st.session_state:
+        return
+    job = default_runner().get(st.query_params.get("job", ""))
+    if job is not None:
+        st.session_state["job_id"] = job.id
+        st.session_state["session_id"] = job.session_id
+
+
+def detach_job():
+    """Отключает сессию от задания; ещё не завершённое задание отменяется."""
+    job_id = st.session_state.get("job_id")
+    if job_id:
+        default_runner().cancel(job_id)
+    st.session_state.pop("job_id", None)
+    st.session_state.pop("collected_job", None)
+    st.session_state.pop("deliveries", None)
+    st.query_params.pop("job", None)
+    default_runner().forget_session(st.session_state["session_id"])
+
+
+def current_job():
+    job_id = st.session_state.get("job_id")
+    return default_runner().get(job_id) if job_id else None
+
+
+def job_running() -> bool:
+    job = current_job()
+    return job is not None and not job.is_finished()
+
+
+def collect_job():
+    """Переносит результат завершённого задания в session_state (один раз на задание)."""
+    job = current_job()
+    if job is None or not job.is_finished() or st.session_state.get("collected_job") == job.id:
+        return
+    st.session_state["collected_job"] = job.id
+    for message in job.messages:
+        st.error(message)
+    if job.message_count > len(job.messages):
+        st.error(f"…и ещё ошибок: {job.message_count - len(job.messages)} (см. лог, фильтр «Только ошибки»)")
+    if job.error is not None:
+        st.error(f"Ошибка при обработке: {job.error}")
+    st.session_state["log"] = job.log
+    if job.result is not None:
+        volumes = job.result.volumes or (job.result_path,)
+        st.session_state["result_zip"] = make_handle(volumes[0])
+        st.session_state["result_parts"] = [make_handle(path) for path in volumes]
+        st.session_state["stats"] = job.result.stats
+        st.session_state["metrics"] = job.result.metrics.ui_summary()
+    # Куда отправлены тома, если не только в браузер: (имя, адрес, ошибка)
+    uploader = job.uploader
+    deliveries = []
+    if uploader is not None and not uploader.sink.in_browser:
+        deliveries = [(d.name, d.location, str(d.error) if d.error else None) for d in uploader.deliveries]
+        for d in uploader.failed:
+            st.error(f"Не удалось отправить {d.name}: {d.error}")
+    st.session_state["deliveries"] = deliveries
+
+
+@st.fragment(run_every=POLL_SECONDS)
+def show_job_progress():
+    """Перерисовывается сам по себе, пока задание работает; по завершении перезапускает всю страницу."""
+    job = current_job()
+    if job is None or job.is_finished():
+        st.rerun()
+    if job.status == JOB_QUEUED:
+        show_queue_position(job)
+        return
+    st.subheader('Обработка изображений...')
+    st.progress(job.fraction, text=job.text or "Подготовка...")
+    for message in job.messages[-3:]:
+        st.error(message)
+    if len(job.log):
+        st.text("\n".join(job.tail()))
+    uploader = job.uploader
+    # Готовые тома можно забирать, не дожидаясь остальных
+    for i, d in enumerate(list(uploader.deliveries) if uploader else [], 1):
+        if uploader.sink.in_browser:
+            download_result(f"📥 Скачать том {i}", d.path, d.name, key=f"volume_{job.id}_{i}")
+        elif d.status == SENDING:
+            st.progress(d.fraction, text=f"📤 {d.name}: {d.sent / (1024 * 1024):.1f} из {d.total / (1024 * 1024):.1f} МБ")
+        else:
+            st.caption(f"📤 {d.name}: {DELIVERY_STATUS[d.status]}")
+    st.caption("Обработка идёт на сервере: страницу можно обновить или закрыть и вернуться по этой же ссылке.")
+
+
+def download_result(label: str, path: str, file_name: str, key: str = None):
+    """
+    Кнопка скачивания архива: ссылка на маршрут, отдающий файл с диска (app.py), или,
+    без него, st.download_button — тогда при нажатии файл целиком читается в память сервера.
+    """
+    if served():
+        st.link_button(label, download_url(path, file_name), key=key)
+    else:
+        st.download_button(label=label, data=make_handle(path).read, file_name=file_name,
+                           mime="application/zip", key=key)
+
+
+def show_queue_position(job):
+    """Место в общей очереди заданий сервера и ожидаемое время запуска."""
+    info = default_runner().queue_info(job)
+    st.subheader("Задание в очереди")
+    if info is None:
+        st.caption("Задание запускается...")
+        return
+    text = f"Место в очереди: {info.position}"
+    if info.start_in is not None:
+        start = time.strftime("%H:%M", time.localtime(time.time() + info.start_in))
+        text += f", ожидаемый запуск через ~{max(1, round(info.start_in / 60))} мин (около {start})"
+    else:
+        text += ", время запуска станет известно, когда текущие задания обработают первые файлы"
+    st.info(text)
+    st.caption("Сервер обрабатывает несколько заданий одновременно, остальные запускаются по очереди. "
+               "Страницу можно закрыть и вернуться по этой же ссылке.")
+
+
+def show_log(log):
+    """Лог постранично, с фильтром ошибок: на страницу уходит не больше LOG_PAGE_LINES строк."""
+    errors_only = st.toggle(f"Только ошибки ({log.error_count})", key="log_errors_only")
+    pages = log.page_count(errors_only)
+    page = st.number_input(f"Страница (из {pages})", min_value=1, max_value=pages, value=pages, step=1, key=f"log_page_{errors_only}")
+    lines = log.page(page - 1, errors_only)
+    st.caption(f"Строк в логе: {len(log)}, показаны {len(lines)} (по {LOG_PAGE_LINES} на странице)")
+    st.text_area("Лог:", value="\n".join(lines), height=300, disabled=True)
@@ -0,0 +1,106 @@
+# joblog.py
+"""
+Лог задания, который не растёт в памяти вместе с пакетом.
+
+Строки сразу дописываются в файл; в памяти остаются только последние
+строки (кольцевой буфер для прогресса) и смещения строк в файле, по которым
+интерфейс читает произвольную страницу или только ошибки. Для движка
+JobLog ведёт себя как список строк: append, extend, len и перебор.
+"""
+import tempfile
+import threading
+from array import array
+from collections import deque
+from typing import Iterator, List
+
+LOG_RING_LINES = 200
+LOG_PAGE_LINES = 200
+ERROR_MARKS = ("❌", "Ошибка")      # так начинаются строки об ошибках в engine.py и sinks.py
+
+
+def is_error_line(line: str) -> bool:
+    return line.startswith(ERROR_MARKS)
+
+
+class JobLog:
+    def __init__(self, path: str = None, ring: int = LOG_RING_LINES):
+        """
+        :param path: Файл лога; без него лог пишется в анонимный временный файл
+        :param ring: Сколько последних строк держать в памяти
+        """
+        self.path = path
+        self._file = open(path, "w+b") if path else tempfile.TemporaryFile()
+        self._recent = deque(maxlen=ring)
+        self._offsets = array("q")     # начало каждой строки в файле
+        self._errors = array("l")      # номера строк с ошибками
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def append(self, line: str):
+        data = line.encode("utf-8") + b"\n"
+        with self._lock:
+            if is_error_line(line):
+                self._errors.append(len(self._offsets))
+            self._offsets.append(self._end)
+            self._file.seek(self._end)
+            self._file.write(data)
+            self._end += len(data)
+            self._recent.append(line)
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.lines(0, len(self)))
+
+    @property
+    def error_count(self) -> int:
+        return len(self._errors)
+
+    def tail(self, n: int = 5) -> List[str]:
+        with self._lock:
+            return list(self._recent)[-n:]
+
+    def lines(self, start: int, count: int) -> List[str]:
+        """Строки start…start+count-1 (читаются из файла)."""
+        with self._lock:
+            stop = min(start + count, len(self._offsets))
+            if start >= stop:
+                return []
+            bounds = list(self._offsets[start:stop]) + [self._offsets[stop] if stop < len(self._offsets) else self._end]
+            self._file.flush()
+            self._file.seek(bounds[0])
+            data = self._file.read(bounds[-1] - bounds[0])
+        base = bounds[0]
+        return [data[a - base:b - base - 1].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+
+    def error_lines(self, start: int, count: int) -> List[str]:
+        """Страница только из строк об ошибках."""
+        with self._lock:
+            numbers = list(self._errors[start:start + count])
+        return [self.lines(n, 1)[0] for n in numbers]
+
+    def page(self, page: int, errors_only: bool = False, page_lines: int = LOG_PAGE_LINES) -> List[str]:
+        """Страница лога (с нуля)."""
+        if errors_only:
+            return self.error_lines(page * page_lines, page_lines)
+        return self.lines(page * page_lines, page_lines)
+
+    def page_count(self, errors_only: bool = False, page_lines: int = LOG_PAGE_LINES) -> int:
+        total = self.error_count if errors_only else len(self)
+        return max(1, -(-total // page_lines))
+
+    def text(self) -> str:
+        """Весь лог одной строкой (для скачивания и log.txt в архиве)."""
+        with self._lock:
+            self._file.flush()
+            self._file.seek(0)
+            return self._file.read(self._end).decode("utf-8")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
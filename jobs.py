@@ -0,0 +1,276 @@
+# jobs.py
+"""
+Фоновое выполнение заданий, не зависящее от перезапусков скрипта Streamlit.
+
+Задание запускается в потоке сервера и получает идентификатор, который
+интерфейс хранит в session_state (и в адресе страницы). Прогресс, лог и
+результат читаются опросом, поэтому взаимодействие с виджетами или
+перезагрузка страницы не прерывают обработку. Модуль не зависит от Streamlit.
+
+Одновременно выполняется не больше max_jobs заданий; остальные ждут
+в очередях по сессиям и запускаются по кругу между сессиями, так что
+пользователь с несколькими пакетами не задерживает остальных. Задания
+делят общий пул процессов (parallel.shared_pool) через очередь своей сессии.
+"""
+import heapq
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from joblog import JobLog
+from parallel import shared_pool
+from results import MAX_AGE_HOURS
+
+MAX_CONCURRENT_JOBS = 2
+MAX_MESSAGES = 50           # ошибок по файлам для показа; остальные только в логе
+DURATION_HISTORY = 20       # завершённых заданий для оценки длительности следующих
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobCancelled(BaseException):
+    """
+    Задание отменено. Наследуется от BaseException, чтобы пройти сквозь
+    обработку ошибок файлов и архива в engine.py (except Exception) до JobRunner.
+    """
+
+
+class Job:
+    """Состояние одного задания; поля меняет поток задания, интерфейс их только читает."""
+
+    def __init__(self, session_id: str, mode: str, result_path: str = None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.mode = mode
+        self.result_path = result_path  # архив-результат на диске
+        self.status = QUEUED
+        self.done = 0
+        self.total = 0
+        self.text = ""
+        # Движок дописывает строки по мере работы; лог лежит рядом с архивом-результатом
+        self.log = JobLog(os.path.join(os.path.dirname(result_path), "job.log") if result_path else None)
+        self.messages: List[str] = []   # первые MAX_MESSAGES ошибок для показа в интерфейсе
+        self.message_count = 0
+        self.uploader = None            # sinks.SinkUploader: отправка готовых томов до завершения задания
+        self.pool = shared_pool().lane(session_id)    # очередь сессии в общем пуле процессов
+        self.result = None              # JobResult после завершения
+        self.error: Optional[Exception] = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+
+    def progress(self, done: int, total: int, text: str):
+        """Callback прогресса для engine.run_*; после отмены прерывает задание (JobCancelled)."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        self.done, self.total, self.text = done, total, text
+
+    def report(self, message: str):
+        """Callback ошибок по отдельным файлам (on_error в engine.run_*)."""
+        self.message_count += 1
+        if len(self.messages) < MAX_MESSAGES:
+            self.messages.append(message)
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 0.0
+
+    def is_finished(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def tail(self, n: int = 5) -> List[str]:
+        return self.log.tail(n)
+
+    def remaining(self, now: float) -> Optional[float]:
+        """Оценка оставшегося времени работающего задания по доле готовых файлов."""
+        if self.started is None or self.fraction <= 0:
+            return None
+        elapsed = now - self.started
+        return elapsed * (1 - self.fraction) / self.fraction
+
+
+class QueueInfo(NamedTuple):
+    """Место задания в очереди и оценка времени его запуска."""
+    position: int                   # 1 — запустится следующим
+    ahead: int                      # заданий в очереди перед ним
+    start_in: Optional[float]       # секунд до запуска; None — оценить пока нельзя
+
+
+class JobRunner:
+    def __init__(self, max_jobs: int = MAX_CONCURRENT_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, Job] = {}
+        self._queues: Dict[str, deque] = {}     # session_id -> deque((job, target))
+        self._served: Dict[str, int] = {}       # session_id -> номер последнего запуска её задания
+        self._starts = 0
+        self._running = 0
+        self._durations = deque(maxlen=DURATION_HISTORY)
+        self._lock = threading.Lock()
+
+    def submit(self, session_id: str, mode: str, target: Callable[[Job], object], result_path: str = None) -> Job:
+        """
+        Ставит задание в очередь.
+        :param result_path: Куда target пишет архив-результат
+        :param target: target(job) выполняет обработку и возвращает JobResult;
+            прогресс и ошибки сообщает через job.progress и job.report
+        """
+        self._prune()
+        job = Job(session_id, mode, result_path)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._queues.setdefault(session_id, deque()).append((job, target))
+        self._start_next()
+        return job
+
+    def _start_next(self):
+        with self._lock:
+            while self._running < self.max_jobs and self._queues:
+                # Одно задание запускает сессия, дольше всех не получавшая слот
+                session_id = min(self._queues, key=lambda sid: self._served.get(sid, 0))
+                queue = self._queues[session_id]
+                job, target = queue.popleft()
+                if not queue:
+                    del self._queues[session_id]
+                self._starts += 1
+                self._served[session_id] = self._starts
+                job.status = RUNNING
+                job.started = time.time()
+                self._running += 1
+                threading.Thread(target=self._run, args=(job, target), name=f"photoflow-job-{job.id[:8]}", daemon=True).start()
+
+    def _run(self, job: Job, target):
+        try:
+            if job.cancelled:
+                raise JobCancelled()
+            job.result = target(job)
+            status = DONE
+        except JobCancelled:
+            job.log.append("⏹️ Задание отменено")
+            status = CANCELLED
+        except Exception as e:
+            job.error = e
+            job.log.append(f"Ошибка задания: {e}")
+            status = FAILED
+        # Время завершения выставляется раньше статуса: по статусу задание считается готовым
+        job.finished = time.time()
+        job.status = status
+        with self._lock:
+            self._running -= 1
+            if status != CANCELLED:
+                self._durations.append(job.finished - job.started)
+        self._start_next()
+
+    def cancel(self, job_id: str):
+        """
+        Отменяет задание: ожидающее убирается из очереди, работающее
+        останавливается при следующем сообщении о прогрессе.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.is_finished():
+                return
+            job._cancel.set()
+            queue = self._queues.get(job.session_id, ())
+            waiting = [entry for entry in queue if entry[0] is job]
+            if not waiting:
+                return
+            queue.remove(waiting[0])
+            if not queue:
+                del self._queues[job.session_id]
+        job.log.append("⏹️ Задание отменено до запуска")
+        job.finished = time.time()
+        job.status = CANCELLED
+
+    def active_dirs(self) -> List[str]:
+        """Папки результатов ожидающих и работающих заданий: их нельзя удалять при очистке."""
+        with self._lock:
+            return [os.path.dirname(j.result_path) for j in self._jobs.values()
+                    if j.result_path and not j.is_finished()]
+
+    def _queue_order(self) -> List[Job]:
+        """Ожидающие задания в порядке запуска (то же правило, что в _start_next)."""
+        queues = {sid: deque(job for job, _ in q) for sid, q in self._queues.items()}
+        served = dict(self._served)
+        order = []
+        while queues:
+            session_id = min(queues, key=lambda sid: served.get(sid, 0))
+            order.append(queues[session_id].popleft())
+            if not queues[session_id]:
+                del queues[session_id]
+            served[session_id] = self._starts + len(order)
+        return order
+
+    def queue_info(self, job: Job) -> Optional[QueueInfo]:
+        """
+        Место задания в очереди и через сколько секунд оно начнётся (None, если не в очереди).
+        Запуск оценивается по оставшемуся времени работающих заданий и средней
+        длительности последних завершённых; пока их нет, оценки нет.
+        """
+        now = time.time()
+        with self._lock:
+            order = self._queue_order()
+            if job not in order:
+                return None
+            ahead = order.index(job)
+            running = [j for j in self._jobs.values() if j.status == RUNNING]
+            average = sum(self._durations) / len(self._durations) if self._durations else None
+        # Моменты освобождения слотов: работающие задания, затем задания перед нашим
+        slots = []
+        for j in running:
+            left = j.remaining(now)
+            if left is None and average is not None:
+                # Задание ещё не обработало ни одного файла: считаем его средним
+                left = max(0.0, average - (now - j.started))
+            slots.append(left)
+        slots += [0.0] * (self.max_jobs - len(slots))
+        if None in slots or (ahead and average is None):
+            return QueueInfo(ahead + 1, ahead, None)
+        heapq.heapify(slots)
+        for _ in range(ahead):
+            heapq.heappush(slots, heapq.heappop(slots) + average)
+        return QueueInfo(ahead + 1, ahead, slots[0])
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def forget_session(self, session_id: str):
+        """Убирает завершённые задания сессии (работающие доводятся до конца)."""
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.session_id == session_id and j.is_finished()]:
+                del self._jobs[job_id]
+
+    def _prune(self):
+        # Результаты старше MAX_AGE_HOURS всё равно удаляются с диска
+        limit = time.time() - MAX_AGE_HOURS * 3600
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.is_finished() and j.finished < limit]:
+                del self._jobs[job_id]
+            active = {j.session_id for j in self._jobs.values()}
+            for session_id in [sid for sid in self._served if sid not in active]:
+                del self._served[session_id]
+
+
+_default_runner = None
+_default_lock = threading.Lock()
+
+
+def default_runner() -> JobRunner:
+    """Общий для всех сессий исполнитель (создаётся при первом обращении)."""
+    global _default_runner
+    with _default_lock:
+        if _default_runner is None:
+            _default_runner = JobRunner()
+        return _default_runner
@@ -0,0 +1,141 @@
+# metrics.py
+"""
+Поэтапные замеры времени и памяти для каждого задания.
+
+Этапы: ingest (чтение/извлечение исходных байтов), prescan (проверка
+заголовков всех файлов до обработки), decode, color
+(перевод в sRGB), transform, encode, archive. Для каждого файла хранится время по этапам, размеры
+на входе и выходе и пик памяти процесса, который его обработал.
+Сводка показывается в интерфейсе и сохраняется в архив как metrics.json.
+"""
+import json
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+STAGES = ("ingest", "prescan", "decode", "color", "transform", "encode", "archive")
+
+
+def peak_rss_mb() -> float:
+    """Пик RSS текущего процесса в МБ (ru_maxrss на Linux — в КБ)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer:
+    """Замер этапов внутри обработки одного файла (в том числе в процессе пула)."""
+
+    def __init__(self):
+        self.spans: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[stage] = self.spans.get(stage, 0.0) + time.perf_counter() - start
+
+
+class JobMetrics:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.started = time.time()
+        self.finished = None
+        self.stage_totals = defaultdict(float)
+        self.files = []
+        self.peak_rss_mb = 0.0
+        self.counters = defaultdict(int)   # например, попадания и промахи кэшей
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    @contextmanager
+    def span(self, stage: str):
+        """Этап уровня задания (например, сбор файлов до начала обработки)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_totals[stage] += time.perf_counter() - start
+
+    def add_file(self, path, bytes_in: int, bytes_out: int, spans: Dict[str, float], peak_mb: float = None, ok: bool = True):
+        for stage, seconds in spans.items():
+            self.stage_totals[stage] += seconds
+        if peak_mb is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, peak_mb)
+        self.files.append({
+            "path": str(path),
+            "ok": ok,
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "spans": {stage: round(seconds, 4) for stage, seconds in spans.items()},
+            "peak_rss_mb": round(peak_mb, 1) if peak_mb is not None else None,
+        })
+
+    def output_bytes(self) -> tuple:
+        """(байт исходников, байт результата) по успешно обработанным файлам."""
+        done = [f for f in self.files if f["ok"] and f["bytes_out"]]
+        return sum(f["bytes_in"] for f in done), sum(f["bytes_out"] for f in done)
+
+    def finish(self):
+        self.finished = time.time()
+        self.peak_rss_mb = max(self.peak_rss_mb, peak_rss_mb())
+
+    def summary(self) -> list:
+        """Строки сводной таблицы: этап, суммарное время, доля, среднее на файл."""
+        total = sum(self.stage_totals.values()) or 1.0
+        count = max(len(self.files), 1)
+        rows = []
+        stages = list(STAGES) + [s for s in self.stage_totals if s not in STAGES]
+        for stage in stages:
+            if stage not in self.stage_totals:
+                continue
+            seconds = self.stage_totals[stage]
+            rows.append({
+                "Этап": stage,
+                "Всего, сек": round(seconds, 2),
+                "Доля, %": round(100 * seconds / total, 1),
+                "Среднее на файл, мс": round(1000 * seconds / count, 1),
+            })
+        return rows
+
+    def ui_summary(self) -> dict:
+        """Компактная сводка для session_state: без списка файлов."""
+        data = self.to_dict()
+        headline = (
+            f"Время: {data['wall_seconds']:.1f} сек, файлов: {data['files_total']}, "
+            f"вход: {data['bytes_in'] / (1024 * 1024):.1f} МБ, выход: {data['bytes_out'] / (1024 * 1024):.1f} МБ, "
+            f"пик памяти: {data['peak_rss_mb']:.0f} МБ"
+        )
+        size_in, size_out = self.output_bytes()
+        if size_in:
+            headline += f", результат — {100 * size_out / size_in:.0f}% от размера исходников"
+        icc_hits = self.counters.get("icc_transform_hits", 0)
+        icc_total = icc_hits + self.counters.get("icc_transform_misses", 0)
+        if icc_total:
+            headline += (f", sRGB: {icc_total} преобразований, кэш ICC {100 * icc_hits / icc_total:.0f}%, "
+                         f"{self.stage_totals.get('color', 0.0):.2f} сек")
+        return {
+            "headline": headline,
+            "rows": self.summary(),
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "mode": self.mode,
+            "started": self.started,
+            "finished": self.finished,
+            "wall_seconds": (self.finished or time.time()) - self.started,
+            "files_total": len(self.files),
+            "bytes_in": sum(f["bytes_in"] for f in self.files),
+            "bytes_out": sum(f["bytes_out"] for f in self.files),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "stages": {stage: round(seconds, 4) for stage, seconds in self.stage_totals.items()},
+            "counters": dict(self.counters),
+            "files": self.files,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, indent=2)
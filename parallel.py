@@ -0,0 +1,261 @@
+# parallel.py
+"""
+Выполнение поштучной обработки изображений в пуле процессов.
+
+Результаты возвращаются строго в порядке подачи, поэтому лог и структура
+архива не зависят от числа процессов. Ошибка на одном файле не останавливает
+пакет: она возвращается вместе с результатом, как и раньше попадала в лог.
+
+Фоновые задания интерфейса работают в одном пуле на процесс сервера
+(FairPool): задания разных сессий делят ядра, а задачи в пул допускаются
+по кругу между сессиями, чтобы большой пакет не занимал весь пул. Оценка
+памяти задач в работе у общего пула одна на сервер (budget.server_budget_mb).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, Optional
+
+
+def default_workers() -> int:
+    """Число доступных процессу ядер."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+class TaskResult(NamedTuple):
+    item: Any                      # исходный элемент (например, ImageSource)
+    value: Any                     # результат fn или None при ошибке
+    error: Optional[Exception]     # исключение или None
+    elapsed: float                 # время выполнения fn в секундах
+
+
+class Precomputed(NamedTuple):
+    """Результат, уже известный в главном потоке (например, из кэша): задача в пул не отправляется."""
+    value: Any
+
+
+class FairPool:
+    """
+    Пул процессов, общий для всех заданий. Задачи ждут в очередях по ключу
+    (идентификатор сессии) и отправляются в процессы по одной из каждой
+    очереди по кругу; в процессах одновременно не больше workers задач,
+    а сумма их стоимостей (оценок памяти) не больше budget. Задача, которая
+    в бюджет не помещается, ждёт своей очереди первой: другие её не обгоняют.
+    """
+
+    def __init__(self, workers: int = None, budget: int = None):
+        """
+        :param budget: Предел суммы cost задач в работе (байт памяти); None — без ограничения
+        """
+        self.workers = workers or default_workers()
+        self.budget = budget
+        self._executor = None
+        self._queues = OrderedDict()    # ключ -> deque((future, fn, args, cost)); порядок — очередь обхода
+        self._running = 0
+        self._charged = 0               # сумма cost задач в работе
+        self._lock = threading.Lock()
+
+    def lane(self, key: str) -> "PoolLane":
+        return PoolLane(self, key)
+
+    def submit(self, key: str, fn: Callable, *args, cost: int = 0) -> Future:
+        future = Future()
+        with self._lock:
+            self._queues.setdefault(key, deque()).append((future, fn, args, cost))
+        self._dispatch()
+        return future
+
+    def queued(self, key: str = None) -> int:
+        """Задач в ожидании: всего или у одного ключа."""
+        with self._lock:
+            if key is not None:
+                return len(self._queues.get(key, ()))
+            return sum(len(q) for q in self._queues.values())
+
+    def _dispatch(self):
+        started = []
+        failed = []
+        with self._lock:
+            while self._running < self.workers and self._queues:
+                key, queue = next(iter(self._queues.items()))
+                future, fn, args, cost = queue[0]
+                if (self.budget and cost and self._running and not future.cancelled()
+                        and self._charged + cost > self.budget):
+                    break       # ждёт, пока завершатся задачи в работе и освободят бюджет
+                # Первая очередь отдаёт одну задачу и уходит в конец круга
+                del self._queues[key]
+                queue.popleft()
+                if queue:
+                    self._queues[key] = queue
+                if not future.set_running_or_notify_cancel():
+                    continue    # отменена, пока ждала (задание остановилось)
+                if self._executor is None:
+                    self._executor = _new_executor(self.workers, self.budget)
+                try:
+                    inner = self._executor.submit(fn, *args)
+                except BrokenProcessPool as e:
+                    # Процесс пула упал: следующие задачи получат новый пул
+                    self._executor = None
+                    failed.append((future, e))
+                    continue
+                self._running += 1
+                self._charged += cost
+                started.append((inner, future, cost))
+        # Вне блокировки: уже завершённая задача вызывает callback сразу, в этом же потоке,
+        # а _finish берёт ту же блокировку
+        for future, e in failed:
+            future.set_exception(e)
+        for inner, future, cost in started:
+            inner.add_done_callback(lambda done, future=future, cost=cost: self._finish(done, future, cost))
+
+    def _finish(self, inner: Future, future: Future, cost: int):
+        with self._lock:
+            self._running -= 1
+            self._charged -= cost
+            if isinstance(inner.exception(), BrokenProcessPool):
+                self._executor = None
+        if inner.exception() is not None:
+            future.set_exception(inner.exception())
+        else:
+            future.set_result(inner.result())
+        self._dispatch()
+
+
+class PoolLane(NamedTuple):
+    """Очередь одной сессии в общем пуле; передаётся в ordered_map как pool."""
+    pool: FairPool
+    key: str
+
+    def submit(self, fn: Callable, *args, cost: int = 0) -> Future:
+        return self.pool.submit(self.key, fn, *args, cost=cost)
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_pool() -> FairPool:
+    """Общий для всех сессий пул процессов (процессы создаются при первой задаче)."""
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            from budget import budget_bytes, server_budget_mb
+
+            _shared_pool = FairPool(budget=budget_bytes(server_budget_mb()))
+        return _shared_pool
+
+
+def _new_executor(workers: int, budget: Optional[int]) -> ProcessPoolExecutor:
+    """Процессы пула знают бюджет памяти, которым проверены их изображения (budget.set_decode_budget)."""
+    from budget import set_decode_budget
+
+    return ProcessPoolExecutor(max_workers=workers, initializer=set_decode_budget, initargs=(budget,))
+
+
+def _timed_call(fn, args):
+    start = time.time()
+    try:
+        return fn(*args), None, time.time() - start
+    except Exception as e:
+        return None, e, time.time() - start
+
+
+def ordered_map(
+    fn: Callable,
+    items: Iterable,
+    make_args: Callable[[Any], tuple],
+    workers: int = 1,
+    window: int = None,
+    budget: int = None,
+    cost: Callable[[Any], int] = None,
+    pool: PoolLane = None,
+) -> Iterator[TaskResult]:
+    """
+    Применяет fn(*make_args(item)) к каждому элементу и отдаёт TaskResult в порядке подачи.
+    :param fn: Функция верхнего уровня модуля (должна сериализоваться pickle)
+    :param make_args: Готовит аргументы в главном потоке (например, читает байты из ZIP);
+        может вернуть Precomputed, тогда fn для элемента не вызывается
+    :param workers: Число процессов; при 1 без pool обработка идёт в текущем процессе
+    :param window: Максимум задач в работе одновременно (по умолчанию workers * 2,
+        с общим пулом — workers), ограничивает объём данных, прочитанных заранее
+    :param budget: Предел суммы cost(item) задач в работе (например, байт памяти);
+        задача, которая в него не помещается, ждёт завершения предыдущих
+    :param cost: Оценка стоимости элемента; вызывается после make_args. С общим пулом
+        стоимость учитывается и в бюджете пула, общем для всех заданий
+    :param pool: Очередь в общем пуле (FairPool.lane); None — свой пул из workers процессов
+        на время вызова. С общим пулом workers ограничивает только число задач в работе,
+        и обработка всегда идёт в процессах пула, в том числе при workers = 1
+    """
+    if pool is not None:
+        window = window or max(1, workers)
+        submit = lambda args, item_cost: pool.submit(_timed_call, fn, args, cost=item_cost)
+        yield from _ordered_submit(submit, items, make_args, window, budget, cost)
+        return
+    if workers <= 1:
+        for item in items:
+            try:
+                args = make_args(item)
+            except Exception as e:
+                yield TaskResult(item, None, e, 0.0)
+                continue
+            if isinstance(args, Precomputed):
+                yield TaskResult(item, args.value, None, 0.0)
+                continue
+            yield TaskResult(item, *_timed_call(fn, args))
+        return
+
+    window = window or workers * 2
+    with _new_executor(workers, budget) as executor:
+        submit = lambda args, item_cost: executor.submit(_timed_call, fn, args)
+        yield from _ordered_submit(submit, items, make_args, window, budget, cost)
+
+
+def _ordered_submit(submit, items, make_args, window, budget, cost) -> Iterator[TaskResult]:
+    pending = deque()
+    in_flight = 0
+
+    def drain_one():
+        nonlocal in_flight
+        item, future, error, item_cost = pending.popleft()
+        in_flight -= item_cost
+        if isinstance(future, Precomputed):
+            return TaskResult(item, future.value, None, 0.0)
+        if future is None:
+            return TaskResult(item, None, error, 0.0)
+        try:
+            return TaskResult(item, *future.result())
+        except Exception as e:
+            # Например, BrokenProcessPool, если процесс-обработчик упал
+            return TaskResult(item, None, e, 0.0)
+
+    try:
+        for item in items:
+            try:
+                args = make_args(item)
+            except Exception as e:
+                pending.append((item, None, e, 0))
+            else:
+                if isinstance(args, Precomputed):
+                    pending.append((item, args, None, 0))
+                else:
+                    item_cost = cost(item) if cost else 0
+                    # Допуск по бюджету задания: ждём завершения более ранних задач
+                    while budget and item_cost and pending and in_flight + item_cost > budget:
+                        yield drain_one()
+                    in_flight += item_cost
+                    pending.append((item, submit(args, item_cost), None, item_cost))
+            while len(pending) >= window:
+                yield drain_one()
+        while pending:
+            yield drain_one()
+    finally:
+        # Задание остановилось раньше (ошибка архива): его задачи не должны занимать общий пул
+        for _, future, _, _ in pending:
+            if isinstance(future, Future):
+                future.cancel()
@@ -0,0 +1,70 @@
+# pipeline.py
+import os
+import streamlit as st
+from archive import DEFAULT_VOLUME_MB
+from budget import MEMORY_BUDGET_MB
+from engine import run_pipeline
+from encoders import DEFAULT_PROFILE
+from ingest import DUPLICATES_FANOUT, detach_uploads, iter_sources
+from job_view import new_result_dir, submit_job
+from metrics import JobMetrics
+from result_cache import default_result_cache
+from sinks import BrowserDownloadSink, SinkUploader
+from water import filter_large_files
+
+
+def process_pipeline_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position, rename=True, workers=1, profile=DEFAULT_PROFILE, memory_budget_mb=MEMORY_BUDGET_MB, duplicates=DUPLICATES_FANOUT, volume_mb=DEFAULT_VOLUME_MB, sink=None, srgb=None):
+    """
+    Конвертация, водяной знак и нумерация за один проход: одно декодирование
+    и одно кодирование на изображение вместо трёх запусков режимов подряд.
+    Водяной знак необязателен («Нет» — только конвертация и нумерация).
+    """
+    uploaded_files = filter_large_files(uploaded_files)
+    if uploaded_files and st.button("Обработать и скачать архив", key="process_pipeline_btn"):
+        job_dir = new_result_dir()
+        # Задание читает загрузки через свои потоки: интерфейс может обращаться к ним одновременно
+        uploads = detach_uploads(uploaded_files, memory_budget_mb=memory_budget_mb)
+        result_zip = os.path.join(job_dir, "result_pipeline.zip")
+        watermark_path = None
+        if preset_choice != "Нет":
+            watermark_path = os.path.join(watermark_dir, preset_choice)
+        elif user_wm_file:
+            watermark_path = user_wm_path
+
+        def task(job):
+            # Выполняется в фоновом потоке: без вызовов st.*
+            metrics = JobMetrics("pipeline")
+            with metrics.span("ingest"):
+                all_images = list(iter_sources(uploads, job.log))
+            if not all_images:
+                job.report("Не найдено ни одного поддерживаемого изображения.")
+            # Готовые тома отправляются в фоне, пока пишутся следующие
+            uploader = job.uploader = SinkUploader(sink or BrowserDownloadSink(), job.log)
+            result = run_pipeline(
+                all_images,
+                result_zip,
+                watermark=watermark_path,
+                position=pos_map[position],
+                opacity=opacity,
+                scale=size_percent/100.0,
+                rename=rename,
+                log=job.log,
+                workers=workers,
+                profile=profile,
+                progress=job.progress,
+                on_error=job.report,
+                metrics=metrics,
+                cache=default_result_cache(),
+                memory_budget_mb=memory_budget_mb,
+                duplicates=duplicates,
+                volume_mb=volume_mb,
+                on_volume=uploader.submit,
+                pool=job.pool,
+                srgb=srgb,
+            )
+            uploader.finish(result.volumes)
+            if result.error is not None:
+                job.report(f"Ошибка при архивации или чтении архива: {result.error}")
+            return result
+
+        submit_job("pipeline", result_zip, task)
@@ -0,0 +1,168 @@
+# prescan.py
+"""
+Предварительная проверка входных файлов по заголовкам.
+
+До начала обработки у каждого файла и члена ZIP читается только заголовок
+(формат, размеры, режим, наличие ICC-профиля) — параллельно, в потоках:
+работа в основном ввод-вывод и распаковка начала члена архива. Файлы,
+заголовок которых не читается, помечаются, и основной цикл пропускает их
+сразу, не читая и не декодируя целиком. Если задан бюджет памяти, здесь же
+решается, с каким уменьшением декодировать файл: то, что не помещается в
+бюджет, пропускается как превышение бюджета, а не как повреждённый файл.
+Сумма мегапикселей вместе с
+недавно измеренной скоростью обработки даёт оценку времени задания.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional
+
+from PIL import Image, UnidentifiedImageError
+
+from budget import ImageHeader, OverBudget, open_header, plan_decode
+from heif import register_heif
+
+PRESCAN_THREADS = 8
+THROUGHPUT_HISTORY = 10         # последних заданий для оценки скорости
+
+
+class UnreadableImage(Exception):
+    """Заголовок изображения не читается: файл повреждён или это не изображение."""
+
+
+class ScanEntry(NamedTuple):
+    header: Optional[ImageHeader]
+    icc: bool                       # есть встроенный ICC-профиль
+    error: Optional[str]            # почему заголовок не прочитан
+    over_budget: Optional[str] = None   # почему файл не помещается в бюджет памяти
+    reduce: int = 1                 # уменьшение при декодировании по бюджету
+
+    @property
+    def megapixels(self) -> float:
+        return self.header.width * self.header.height / 1e6 if self.header else 0.0
+
+
+class Prescan(NamedTuple):
+    entries: Dict[int, ScanEntry]   # id(ImageSource) -> результат проверки
+    megapixels: float               # всего по читаемым файлам
+    bad: int                        # файлов с нечитаемым заголовком
+    over_budget: int                # файлов, не помещающихся в бюджет памяти
+    with_icc: int
+    elapsed: float
+
+    def get(self, src) -> Optional[ScanEntry]:
+        return self.entries.get(id(src))
+
+
+def scan_header(src, budget: Optional[int] = None) -> ScanEntry:
+    """
+    Заголовок одного ImageSource; пиксели не декодируются.
+    :param budget: бюджет памяти в байтах; None — без ограничения
+    """
+    register_heif()
+    bomb = None
+    try:
+        with src.open() as f:
+            try:
+                img = Image.open(f)
+            except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+                # Предел Pillow в потоках сервера не снимается: размер читается из заголовка без проверки,
+                # а декодировать ли такое изображение, решает бюджет
+                bomb = e
+                img = open_header(f)
+            with img:
+                header = ImageHeader(img.format, img.width, img.height, img.mode)
+                icc = bool(img.info.get("icc_profile"))
+    except UnidentifiedImageError:
+        return ScanEntry(None, False, "формат не распознан")
+    except Exception as e:
+        # Image.open сообщает о повреждённых файлах разными исключениями
+        return ScanEntry(None, False, str(e) or type(e).__name__)
+    if not header.width or not header.height:
+        return ScanEntry(None, False, f"нулевой размер {header.width}×{header.height}")
+    if isinstance(bomb, Image.DecompressionBombError) and not budget:
+        # Без бюджета действует предел Pillow: такой файл пропускается как слишком большой, а не повреждённый
+        return ScanEntry(header, icc, None, over_budget=str(bomb))
+    if budget:
+        try:
+            return ScanEntry(header, icc, None, reduce=plan_decode(header, budget))
+        except OverBudget as e:
+            return ScanEntry(header, icc, None, over_budget=str(e))
+    return ScanEntry(header, icc, None)
+
+
+def prescan(sources, budget: Optional[int] = None, threads: int = PRESCAN_THREADS) -> Prescan:
+    """
+    Проверяет заголовки всех источников в пуле потоков.
+    :param budget: бюджет памяти в байтах; None — без ограничения
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="photoflow-prescan") as pool:
+        results = list(pool.map(lambda src: scan_header(src, budget), sources))
+    entries = {id(src): entry for src, entry in zip(sources, results)}
+    return Prescan(
+        entries,
+        sum(entry.megapixels for entry in results),
+        sum(1 for entry in results if entry.error),
+        sum(1 for entry in results if entry.over_budget),
+        sum(1 for entry in results if entry.icc),
+        time.perf_counter() - start,
+    )
+
+
+# Скорость обработки (Мпикс/сек) последних заданий по режимам; живёт, пока живёт процесс сервера
+_throughput = defaultdict(lambda: deque(maxlen=THROUGHPUT_HISTORY))
+_throughput_lock = threading.Lock()
+
+
+def record_throughput(mode: str, megapixels: float, seconds: float):
+    if megapixels > 0 and seconds > 0:
+        with _throughput_lock:
+            _throughput[mode].append(megapixels / seconds)
+
+
+def recent_throughput(mode: str) -> Optional[float]:
+    """Средняя скорость последних заданий режима в Мпикс/сек; None — замеров ещё нет."""
+    with _throughput_lock:
+        history = list(_throughput.get(mode, ()))
+    return sum(history) / len(history) if history else None
+
+
+class EtaTracker:
+    """
+    Оценка оставшегося времени по мегапикселям: пока не обработано ни одного
+    файла — по скорости прошлых заданий, затем по скорости текущего.
+    """
+
+    def __init__(self, total_mp: float, mode: str):
+        self.total_mp = total_mp
+        self.mode = mode
+        self.done_mp = 0.0
+        self.started = time.perf_counter()
+
+    def add(self, megapixels: float):
+        self.done_mp += megapixels
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def remaining(self) -> Optional[float]:
+        rate = self.done_mp / self.elapsed if self.done_mp and self.elapsed else recent_throughput(self.mode)
+        if not rate:
+            return None
+        return max(0.0, self.total_mp - self.done_mp) / rate
+
+    def finish(self):
+        record_throughput(self.mode, self.done_mp, self.elapsed)
+
+
+def format_eta(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return ""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"~{seconds} сек"
+    return f"~{seconds // 60} мин {seconds % 60:02d} сек"
+
@@ -0,0 +1,121 @@
+# result_cache.py
+"""
+Постоянный кэш обработанных изображений на диске.
+
+Ключ — sha256 исходных байтов плюс все параметры обработки (режим,
+хэш водяного знака, положение, прозрачность, масштаб, настройки
+кодировщика). Повторная загрузка того же архива после смены одной
+настройки пересчитывает только то, что действительно изменилось.
+Размер ограничен; при переполнении удаляются давно не использованные записи.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+
+CACHE_ROOT = os.path.join(tempfile.gettempdir(), "photoflow_cache")
+MAX_CACHE_MB = 2048
+CACHE_VERSION = 1   # увеличить при изменении алгоритмов обработки
+
+
+class ResultCache:
+    def __init__(self, root: str = CACHE_ROOT, max_mb: int = MAX_CACHE_MB):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._total = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def make_key(data: bytes, params: tuple) -> str:
+        h = hashlib.sha256(data)
+        h.update(repr((CACHE_VERSION,) + tuple(params)).encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str):
+        """Байты результата или None. Попадание обновляет время использования записи."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes):
+        path = self._path(key)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Запись через временный файл: параллельные задания не увидят обрезанный результат
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._total += len(data)
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        """(время использования, путь, размер) всех записей."""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, path, st.st_size))
+        return entries
+
+    def evict(self):
+        """Удаляет давно не использованные записи, пока кэш не станет меньше 90% лимита."""
+        entries = sorted(self._entries())
+        total = sum(size for _, _, size in entries)
+        target = self.max_bytes * 0.9
+        for _, path, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._total = total
+
+    def clear(self):
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._total = 0
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+def default_result_cache() -> ResultCache:
+    """Общий для всех сессий экземпляр кэша (создаётся при первом обращении)."""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResultCache()
+        return _default_cache
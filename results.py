@@ -0,0 +1,121 @@
+# results.py
+"""
+Хранилище архивов-результатов на диске.
+
+Каждая сессия получает свою папку, каждое задание — подпапку внутри неё.
+В session_state кладётся только ResultHandle (путь), а не байты архива;
+как архив отдаётся браузеру, описано в downloads.py.
+Старые и лишние результаты удаляются по возрасту и общему размеру.
+"""
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import NamedTuple
+
+RESULTS_ROOT = os.path.join(tempfile.gettempdir(), "photoflow_results")
+MAX_TOTAL_MB = 4096          # общий лимит результатов всех сессий
+MAX_AGE_HOURS = 6            # результаты старше удаляются
+
+
+class ResultHandle(NamedTuple):
+    """Ссылка на готовый архив на диске."""
+    path: str
+    job_id: str
+    created: float
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    @property
+    def size(self) -> int:
+        return os.path.getsize(self.path) if self.exists() else 0
+
+    def read(self) -> bytes:
+        """Весь файл в памяти: так его забирает st.download_button (см. downloads.py)."""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def _session_dir(session_id: str) -> str:
+    return os.path.join(RESULTS_ROOT, session_id)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _job_dirs():
+    """Все папки заданий: (mtime, путь, размер), от старых к новым."""
+    jobs = []
+    if not os.path.isdir(RESULTS_ROOT):
+        return jobs
+    for session in os.scandir(RESULTS_ROOT):
+        if not session.is_dir():
+            continue
+        for job in os.scandir(session.path):
+            if job.is_dir():
+                try:
+                    jobs.append((job.stat().st_mtime, job.path, _dir_size(job.path)))
+                except OSError:
+                    pass
+    jobs.sort()
+    return jobs
+
+
+def evict(max_total_mb: int = MAX_TOTAL_MB, max_age_hours: float = MAX_AGE_HOURS, keep=()) -> int:
+    """
+    Удаляет задания старше max_age_hours, затем самые старые задания,
+    пока общий размер не станет меньше max_total_mb. Возвращает число удалённых.
+    :param keep: Папки заданий, которые ещё работают или ждут запуска (jobs.JobRunner.active_dirs)
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    now = time.time()
+    max_bytes = max_total_mb * 1024 * 1024
+    jobs = _job_dirs()
+    total = sum(size for _, _, size in jobs)
+    removed = 0
+    for mtime, path, size in jobs:
+        if os.path.abspath(path) in keep:
+            continue
+        # Пустые папки места не занимают: по размеру не удаляются (может быть только что созданная)
+        if now - mtime > max_age_hours * 3600 or (size and total > max_bytes):
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+    return removed
+
+
+def new_job_dir(session_id: str, keep=()) -> str:
+    """
+    Создаёт папку для нового задания сессии. Прежние результаты этой сессии
+    больше не нужны и удаляются, заодно выполняется общая очистка.
+    :param keep: Папки незавершённых заданий (любых сессий), которые удалять нельзя
+    """
+    keep = [os.path.abspath(path) for path in keep]
+    session_dir = _session_dir(session_id)
+    if os.path.isdir(session_dir):
+        for job in os.scandir(session_dir):
+            if os.path.abspath(job.path) not in keep:
+                shutil.rmtree(job.path, ignore_errors=True)
+    evict(keep=keep)
+    job_dir = os.path.join(session_dir, uuid.uuid4().hex)
+    os.makedirs(job_dir, exist_ok=True)
+    return job_dir
+
+
+def make_handle(path: str) -> ResultHandle:
+    return ResultHandle(path, os.path.basename(os.path.dirname(path)), time.time())
+
+
+def discard_session(session_id: str):
+    """Удаляет все результаты сессии (кнопка «Начать сначала»)."""
+    shutil.rmtree(_session_dir(session_id), ignore_errors=True)
@@ -0,0 +1,352 @@
+# sinks.py
+"""
+Куда отправляются готовые тома архива результата.
+
+OutputSink.send(path, progress) доставляет один файл и возвращает его адрес
+(путь, URL). Реализации:
+  BrowserDownloadSink — файл остаётся на сервере и скачивается кнопкой в браузере;
+  LocalDirSink        — копия в папку на диске;
+  HttpUploadSink      — загрузка по HTTP с пулом соединений, повторами и докачкой.
+
+Из веб-интерфейса доступны только получатели, настроенные оператором:
+  PHOTOFLOW_EXPORT_ROOT — папка, внутри которой пользователь выбирает подпапку
+  для LocalDirSink (выйти за её пределы нельзя);
+  PHOTOFLOW_UPLOAD_URLS — адреса загрузки для HttpUploadSink через запятую.
+Без этих переменных в интерфейсе остаётся только скачивание в браузере.
+Консольный запуск (cli.py) принимает любые пути и адреса: его запускает оператор.
+
+SinkUploader отправляет тома в фоновом потоке по мере их готовности
+(callback on_volume в engine.run_*), пока следующие тома ещё пишутся.
+
+Протокол HttpUploadSink:
+  файл не больше chunk_bytes — один POST multipart/form-data на url
+  (поле field_name, имя файла — имя тома);
+  больше — PUT на url/<имя тома> частями с заголовком
+  «Content-Range: bytes начало-конец/размер». Сервер отвечает 308 с заголовком
+  «Range: bytes=0-N», пока файл не принят целиком, и 200/201 на последнюю часть.
+  После обрыва соединения докачка начинается с запроса состояния
+  (PUT без тела, «Content-Range: bytes */размер»), без повтора принятых частей.
+  Адрес результата берётся из JSON-ответа (download_url или url), заголовка
+  Location или совпадает с адресом загрузки.
+"""
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+from urllib.parse import quote
+
+UPLOAD_CHUNK_MB = 8
+UPLOAD_RETRIES = 3
+UPLOAD_TIMEOUT = 60          # секунд на один запрос
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+EXPORT_ROOT_ENV = "PHOTOFLOW_EXPORT_ROOT"
+UPLOAD_URLS_ENV = "PHOTOFLOW_UPLOAD_URLS"
+
+QUEUED = "queued"
+SENDING = "sending"
+DONE = "done"
+FAILED = "failed"
+
+SendProgress = Callable[[int, int], None]   # (отправлено байт, всего байт)
+
+
+class UploadStalled(Exception):
+    """Сервер отвечает 308, но принятая часть файла не растёт."""
+
+
+class OutputSink:
+    """Получатель томов архива."""
+
+    label = ""
+    in_browser = False          # True — тома забираются кнопкой скачивания
+
+    def send(self, path: str, progress: SendProgress = None) -> str:
+        """Доставляет файл и возвращает его адрес."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class BrowserDownloadSink(OutputSink):
+    """Тома остаются в хранилище результатов (results.py) и скачиваются из интерфейса."""
+
+    label = "Скачать в браузере"
+    in_browser = True
+
+    def send(self, path: str, progress: SendProgress = None) -> str:
+        if progress:
+            size = os.path.getsize(path)
+            progress(size, size)
+        return path
+
+
+class LocalDirSink(OutputSink):
+    """Копирует тома в папку; файл появляется под своим именем только целиком."""
+
+    label = "Папка на сервере"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def send(self, path: str, progress: SendProgress = None) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        dst = os.path.join(self.directory, os.path.basename(path))
+        tmp = dst + ".part"
+        size = os.path.getsize(path)
+        sent = 0
+        with open(path, "rb") as fsrc, open(tmp, "wb") as fdst:
+            while True:
+                chunk = fsrc.read(1024 * 1024)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                sent += len(chunk)
+                if progress:
+                    progress(sent, size)
+        shutil.copystat(path, tmp)
+        os.replace(tmp, dst)
+        return dst
+
+
+def export_root() -> Optional[str]:
+    """Папка оператора для LocalDirSink из интерфейса; None — не настроена."""
+    root = os.environ.get(EXPORT_ROOT_ENV, "").strip()
+    return os.path.realpath(root) if root else None
+
+
+def export_dir(root: str, name: str) -> str:
+    """
+    Подпапка name внутри root.
+    :raises ValueError: если путь выходит за пределы root
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, name.strip()))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"папка {name!r} выходит за пределы {root}")
+    return path
+
+
+def upload_endpoints() -> List[str]:
+    """Адреса загрузки, разрешённые оператором для HttpUploadSink из интерфейса."""
+    return [url.strip() for url in os.environ.get(UPLOAD_URLS_ENV, "").split(",") if url.strip()]
+
+
+class HttpUploadSink(OutputSink):
+    """
+    Загрузка на HTTP-сервер (протокол — в описании модуля). Одна сессия
+    requests на получателя: соединение переиспользуется для всех частей и томов.
+    Части (PUT) после ответов 429/5xx повторяются с нарастающей паузой, после
+    обрыва соединения — докачиваются с последнего принятого сервером байта.
+    Файл одним POST не повторяется: сервер мог его уже сохранить.
+    """
+
+    label = "Загрузка по HTTP"
+
+    def __init__(self, url: str, chunk_mb: int = UPLOAD_CHUNK_MB, retries: int = UPLOAD_RETRIES,
+                 timeout: float = UPLOAD_TIMEOUT, backoff: float = 1.0, headers: dict = None,
+                 field_name: str = "files"):
+        """
+        :param chunk_mb: Размер части; файлы не больше него отправляются одним запросом
+        :param retries: Сколько раз повторять часть после ошибки сервера или обрыва
+        :param headers: Дополнительные заголовки (например, Authorization)
+        """
+        self.url = url
+        self.chunk_bytes = chunk_mb * 1024 * 1024
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.headers = headers or {}
+        self.field_name = field_name
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None:
+            # requests нужен только для загрузки: импорт не замедляет запуск приложения
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            # Отказ в соединении пул повторяет для любых запросов: до сервера они не дошли.
+            # Ответы 429/5xx — только для PUT частей: Content-Range задаёт место части в файле,
+            # и повтор её не дублирует, а повтор POST целого файла мог бы создать вторую загрузку.
+            # Обрыв посреди запроса не повторяется: сервер мог принять часть тела, докачка идёт
+            # через _query_offset
+            retry = Retry(
+                total=self.retries,
+                read=0,
+                other=0,
+                backoff_factor=self.backoff,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=frozenset({"PUT"}),
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            session.headers.update(self.headers)
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            self._session = session
+        return self._session
+
+    def send(self, path: str, progress: SendProgress = None) -> str:
+        progress = progress or (lambda sent, total: None)
+        name = os.path.basename(path)
+        size = os.path.getsize(path)
+        if size <= self.chunk_bytes:
+            return self._send_whole(path, name, size, progress)
+        return self._send_chunked(path, name, size, progress)
+
+    def _send_whole(self, path, name, size, progress) -> str:
+        # Без повторов после ответа или обрыва: сервер мог уже сохранить файл (см. _get_session)
+        with open(path, "rb") as f:
+            data = f.read()
+        resp = self._get_session().post(self.url, files={self.field_name: (name, data, "application/zip")},
+                                        timeout=self.timeout)
+        resp.raise_for_status()
+        progress(size, size)
+        return _location(resp, self.url)
+
+    def _send_chunked(self, path, name, size, progress) -> str:
+        import requests
+
+        session = self._get_session()
+        url = f"{self.url.rstrip('/')}/{quote(name)}"
+        offset = 0          # None — сколько принято, надо спросить у сервера
+        failures = 0
+        stalled = 0
+        with open(path, "rb") as f:
+            while True:
+                try:
+                    if offset is None:
+                        offset = self._query_offset(session, url, size)
+                    f.seek(offset)
+                    chunk = f.read(self.chunk_bytes)
+                    end = offset + len(chunk) - 1
+                    resp = session.put(url, data=chunk, timeout=self.timeout,
+                                       headers={"Content-Range": f"bytes {offset}-{end}/{size}"})
+                except (requests.ConnectionError, requests.Timeout):
+                    # Обрыв, в том числе при запросе состояния: после паузы сверяемся с сервером
+                    failures += 1
+                    if failures > self.retries:
+                        raise
+                    time.sleep(self.backoff * 2 ** (failures - 1))
+                    offset = None
+                    continue
+                if resp.status_code == 308:
+                    accepted = _next_offset(resp, end + 1)
+                    # Сервер отвечает «продолжайте», но не принимает данные: не повторяем бесконечно
+                    stalled = stalled + 1 if accepted <= offset else 0
+                    if stalled > self.retries:
+                        raise UploadStalled(f"{name}: сервер не принимает данные после {offset} байт")
+                    offset = accepted
+                    progress(offset, size)
+                    continue
+                if resp.status_code == 416 and failures < self.retries:
+                    # Сервер принял другое число байт, чем мы считаем: сверяемся и продолжаем
+                    failures += 1
+                    offset = None
+                    continue
+                resp.raise_for_status()
+                progress(size, size)
+                return _location(resp, url)
+
+    def _query_offset(self, session, url: str, size: int) -> int:
+        """Сколько байт сервер уже принял (для докачки после обрыва)."""
+        resp = session.put(url, timeout=self.timeout, headers={"Content-Range": f"bytes */{size}"})
+        if resp.status_code == 308:
+            return _next_offset(resp, 0)
+        resp.raise_for_status()
+        return 0
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+def _next_offset(resp, default: int) -> int:
+    match = re.match(r"bytes=0-(\d+)", resp.headers.get("Range", ""))
+    return int(match.group(1)) + 1 if match else default
+
+
+def _location(resp, default: str) -> str:
+    try:
+        payload = resp.json()
+    except ValueError:
+        payload = None
+    if isinstance(payload, dict) and (payload.get("download_url") or payload.get("url")):
+        return payload.get("download_url") or payload.get("url")
+    return resp.headers.get("Location") or default
+
+
+class Delivery:
+    """Состояние отправки одного тома; меняет поток отправки, интерфейс только читает."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.status = QUEUED
+        self.sent = 0
+        self.total = 0
+        self.location: Optional[str] = None
+        self.error: Optional[Exception] = None
+
+    def progress(self, sent: int, total: int):
+        self.sent, self.total = sent, total
+
+    @property
+    def fraction(self) -> float:
+        return self.sent / self.total if self.total else 0.0
+
+
+class SinkUploader:
+    """
+    Отправляет тома по одному в фоновом потоке, в порядке готовности.
+    submit подходит как on_volume для engine.run_*; finish дожидается
+    отправки последнего тома и всех предыдущих.
+    """
+
+    def __init__(self, sink: OutputSink, log: List[str] = None):
+        self.sink = sink
+        self.log = log if log is not None else []
+        self.deliveries: List[Delivery] = []
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="photoflow-upload")
+        self._lock = threading.Lock()
+
+    def submit(self, path: str):
+        with self._lock:
+            if any(d.path == path for d in self.deliveries):
+                return
+            delivery = Delivery(path)
+            self.deliveries.append(delivery)
+        self._executor.submit(self._send, delivery)
+
+    def _send(self, delivery: Delivery):
+        delivery.status = SENDING
+        start = time.perf_counter()
+        try:
+            delivery.location = self.sink.send(delivery.path, delivery.progress)
+            delivery.status = DONE
+            if not self.sink.in_browser:
+                self.log.append(f"📤 {delivery.name} отправлен ({self.sink.label}): {delivery.location} "
+                                f"(время: {time.perf_counter() - start:.2f} сек)")
+        except Exception as e:
+            delivery.error = e
+            delivery.status = FAILED
+            self.log.append(f"❌ {delivery.name}: не удалось отправить ({self.sink.label}): {e}")
+
+    def finish(self, paths=()) -> List[Delivery]:
+        """Ставит в очередь ещё не отправленные тома из paths и ждёт окончания отправки."""
+        for path in paths:
+            self.submit(path)
+        self._executor.shutdown(wait=True)
+        self.sink.close()
+        return self.deliveries
+
+    @property
+    def failed(self) -> List[Delivery]:
+        return [d for d in self.deliveries if d.status == FAILED]
@@ -0,0 +1,67 @@
+# tests/test_archive.py
+"""
+Перенос членов ZIP без распаковки (copy_member_raw) и его запасной путь
+через повторное сжатие.
+
+Запуск из корня репозитория: python -m pytest tests  или  python -m unittest discover tests
+"""
+import io
+import os
+import unittest
+import zipfile
+from unittest import mock
+
+from archive import _MASK_DATA_DESCRIPTOR, copy_member_raw
+
+
+class _Unseekable:
+    """Поток только для записи: zipfile пишет в него члены с дескриптором данных."""
+
+    def __init__(self):
+        self.buf = io.BytesIO()
+
+    def write(self, data):
+        return self.buf.write(data)
+
+    def flush(self):
+        pass
+
+
+class CopyMemberRawTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = os.urandom(50_000) + b"photo" * 20_000
+        stream = _Unseekable()
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("src/a.jpg", self.data)
+        self.src = zipfile.ZipFile(io.BytesIO(stream.buf.getvalue()))
+        self.info = self.src.getinfo("src/a.jpg")
+        self.assertTrue(self.info.flag_bits & _MASK_DATA_DESCRIPTOR)
+
+    def tearDown(self):
+        self.src.close()
+
+    def copy(self):
+        out = io.BytesIO()
+        with zipfile.ZipFile(out, "w") as dst:
+            copy_member_raw(self.src, self.info, dst, "renamed/1.jpg")
+        return zipfile.ZipFile(io.BytesIO(out.getvalue()))
+
+    def test_data_descriptor_member(self):
+        with self.copy() as result:
+            self.assertIsNone(result.testzip())
+            info = result.getinfo("renamed/1.jpg")
+            self.assertEqual(info.compress_size, self.info.compress_size)
+            self.assertFalse(info.flag_bits & _MASK_DATA_DESCRIPTOR)
+            self.assertEqual(result.read(info), self.data)
+
+    def test_falls_back_without_zipfile_internals(self):
+        with mock.patch("archive._copy_compressed", side_effect=AttributeError("_writecheck")):
+            result = self.copy()
+        with result:
+            self.assertIsNone(result.testzip())
+            self.assertEqual(result.read("renamed/1.jpg"), self.data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,217 @@
+# tests/test_sinks.py
+"""
+HttpUploadSink против локального stub-сервера (протокол — в описании sinks.py)
+и ограничение папки LocalDirSink корнем оператора.
+
+Запуск из корня репозитория: python -m pytest tests  или  python -m unittest discover tests
+"""
+import email
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from sinks import DONE, HttpUploadSink, LocalDirSink, SinkUploader, UploadStalled, export_dir
+
+
+class StubUploadHandler(BaseHTTPRequestHandler):
+    """
+    Сервер загрузки: POST multipart для целого файла, PUT с Content-Range для частей.
+    Сбои задаются счётчиками сервера: fail_next — ответ 503, drop_next — принять
+    половину части и оборвать соединение, drop_query_next — оборвать соединение
+    на запросе состояния, stall — принять первую часть, а дальше отвечать 308,
+    не принимая данных.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body=b"", headers=()):
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _received(self, buf):
+        return [("Range", f"bytes=0-{len(buf) - 1}")] if buf else []
+
+    def do_POST(self):
+        srv = self.server
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        srv.posts += 1
+        if srv.fail_next:
+            srv.fail_next -= 1
+            return self._reply(503)
+        msg = email.message_from_bytes(b"Content-Type: " + self.headers["Content-Type"].encode() + b"\r\n\r\n" + raw)
+        for part in msg.get_payload():
+            name = part.get_filename()
+            srv.store[name] = bytearray(part.get_payload(decode=True))
+        body = json.dumps({"download_url": f"http://stub/{name}"}).encode()
+        self._reply(201, body, [("Content-Type", "application/json")])
+
+    def do_PUT(self):
+        srv = self.server
+        name = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        buf = srv.store.setdefault(name, bytearray())
+        match = re.match(r"bytes (\d+)-(\d+)/(\d+)", self.headers["Content-Range"])
+        if match is None:
+            # Запрос состояния: «bytes */размер»
+            srv.status_queries += 1
+            if srv.drop_query_next:
+                srv.drop_query_next -= 1
+                self.close_connection = True
+                self.connection.shutdown(2)
+                return
+            return self._reply(308, headers=self._received(buf))
+        if srv.fail_next:
+            srv.fail_next -= 1
+            return self._reply(503)
+        start, _, total = map(int, match.groups())
+        if start != len(buf):
+            return self._reply(416)
+        if srv.stall and buf:
+            return self._reply(308, headers=self._received(buf))
+        if srv.drop_next:
+            srv.drop_next -= 1
+            buf.extend(body[:len(body) // 2])
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return
+        srv.parts.append(start)
+        buf.extend(body)
+        if len(buf) < total:
+            return self._reply(308, headers=self._received(buf))
+        self._reply(201, headers=[("Location", f"http://stub/{name}")])
+
+
+class HttpUploadSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubUploadHandler)
+        self.server.store = {}
+        self.server.parts = []
+        self.server.fail_next = 0
+        self.server.drop_next = 0
+        self.server.status_queries = 0
+        self.server.drop_query_next = 0
+        self.server.stall = False
+        self.server.posts = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/up"
+        self.tmp = tempfile.mkdtemp(prefix="photoflow-test-")
+        self.sink = HttpUploadSink(self.url, chunk_mb=1, retries=3, backoff=0.01)
+
+    def tearDown(self):
+        self.sink.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def make_file(self, name, size):
+        path = os.path.join(self.tmp, name)
+        with open(path, "wb") as f:
+            f.write(os.urandom(size))
+        return path
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_small_file_sent_in_one_post(self):
+        path = self.make_file("small.zip", 300_000)
+        location = self.sink.send(path)
+        self.assertEqual(location, "http://stub/small.zip")
+        self.assertEqual(bytes(self.server.store["small.zip"]), self.read(path))
+
+    def test_small_file_not_retried_after_503(self):
+        # Повтор POST мог бы создать на сервере вторую копию файла
+        path = self.make_file("small.zip", 300_000)
+        self.server.fail_next = 1
+        with self.assertRaises(requests.HTTPError):
+            self.sink.send(path)
+        self.assertEqual(self.server.posts, 1)
+
+    def test_chunked_resume_after_dropped_connection(self):
+        path = self.make_file("big.zip", 3 * 1024 * 1024 + 1000)
+        self.server.drop_next = 1
+        progress = []
+        location = self.sink.send(path, lambda sent, total: progress.append((sent, total)))
+        self.assertEqual(location, "http://stub/big.zip")
+        self.assertEqual(bytes(self.server.store["big.zip"]), self.read(path))
+        # После обрыва клиент спросил состояние и продолжил с принятого байта, не начиная заново
+        self.assertEqual(self.server.status_queries, 1)
+        self.assertNotIn(0, self.server.parts)
+        self.assertEqual(progress[-1], (os.path.getsize(path), os.path.getsize(path)))
+
+    def test_chunked_resume_after_dropped_status_query(self):
+        path = self.make_file("big.zip", 3 * 1024 * 1024 + 1000)
+        self.server.drop_next = 1
+        self.server.drop_query_next = 1
+        self.sink.send(path)
+        self.assertEqual(bytes(self.server.store["big.zip"]), self.read(path))
+        self.assertEqual(self.server.status_queries, 2)
+
+    def test_chunked_fails_when_server_stalls(self):
+        path = self.make_file("big.zip", 2 * 1024 * 1024 + 10)
+        self.server.stall = True
+        with self.assertRaises(UploadStalled):
+            self.sink.send(path)
+        self.assertEqual(len(self.server.store["big.zip"]), 1024 * 1024)
+
+    def test_chunked_part_retried_after_503(self):
+        path = self.make_file("big.zip", 2 * 1024 * 1024 + 10)
+        self.server.fail_next = 1
+        self.sink.send(path)
+        self.assertEqual(bytes(self.server.store["big.zip"]), self.read(path))
+        self.assertEqual(self.server.status_queries, 0)
+
+    def test_uploader_sends_volumes_in_background(self):
+        paths = [self.make_file(f"part{i}.zip", 200_000 * i) for i in (1, 2)]
+        log = []
+        uploader = SinkUploader(self.sink, log)
+        uploader.submit(paths[0])
+        deliveries = uploader.finish(paths)
+        self.assertEqual([d.status for d in deliveries], [DONE, DONE])
+        self.assertEqual(uploader.failed, [])
+        for path in paths:
+            self.assertEqual(bytes(self.server.store[os.path.basename(path)]), self.read(path))
+
+
+class ExportDirTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix="photoflow-export-"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_subfolder_inside_root(self):
+        self.assertEqual(export_dir(self.root, ""), self.root)
+        self.assertEqual(export_dir(self.root, "a/b"), os.path.join(self.root, "a", "b"))
+
+    def test_paths_outside_root_rejected(self):
+        for name in ("..", "../other", "a/../../other", "/etc"):
+            with self.assertRaises(ValueError):
+                export_dir(self.root, name)
+
+    def test_local_sink_writes_under_root(self):
+        src = os.path.join(self.root, "src.zip")
+        with open(src, "wb") as f:
+            f.write(b"data")
+        dst = LocalDirSink(export_dir(self.root, "out")).send(src)
+        self.assertEqual(dst, os.path.join(self.root, "out", "src.zip"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,221 +1,133 @@
-from io import BytesIO
+import hashlib
 import os
-import zipfile
 import tempfile
-from pathlib import Path
-from PIL import Image
+import zipfile
+from functools import lru_cache
+from io import BytesIO
 import streamlit as st
+from archive import DEFAULT_VOLUME_MB
+from budget import MEMORY_BUDGET_MB
+from engine import run_watermark
+from encoders import DEFAULT_PROFILE
+from imaging import apply_watermark, get_preview_image, prepare_watermark, watermark_digest
+from ingest import DUPLICATES_FANOUT, detach_uploads, is_supported, iter_sources
+from job_view import new_result_dir, submit_job
+from metrics import JobMetrics
+from result_cache import default_result_cache
+from sinks import BrowserDownloadSink, SinkUploader
+
+
+def list_watermark_presets(watermark_dir):
+    """Список готовых знаков; папка перечитывается только при её изменении."""
+    if not os.path.exists(watermark_dir):
+        return []
+    return list(_list_presets(watermark_dir, os.stat(watermark_dir).st_mtime_ns))
+
+
+@lru_cache(maxsize=4)
+def _list_presets(watermark_dir, mtime_ns):
+    return tuple(sorted(f for f in os.listdir(watermark_dir) if f.lower().endswith((".png", ".jpg", ".jpeg"))))
+
 
-def apply_watermark(
-    base_image: Image.Image,
-    watermark_path: str = None,
-    position: str = "bottom_right",
-    opacity: float = 0.5,
-    scale: float = 0.2,
-) -> Image.Image:
+def save_user_watermark(user_wm_file):
     """
-    Накладывает водяной знак (PNG или текст) на изображение.
-    :param base_image: Исходное изображение (PIL.Image)
-    :param watermark_path: Путь к PNG-водяном знаку (или BytesIO, или None)
-    :param text: Текст для текстового водяного знака (или None)
-    :param position: Позиция ('top_left', 'top_right', 'center', 'bottom_left', 'bottom_right')
-    :param opacity: Прозрачность (0.0-1.0)
-    :param scale: Масштаб водяного знака относительно ширины base_image (0.0-1.0)
-    :param text_options: dict с параметрами текста (font_path, font_size, color)
-    :return: Новое изображение с водяным знаком
+    Сохраняет загруженный знак во временную папку под именем по хэшу содержимого:
+    при перезапусках скрипта файл не перезаписывается.
     """
-    assert watermark_path or text, "Нужно указать watermark_path или text"
-    img = base_image.convert("RGBA")
-    wm = None
-    if watermark_path:
-        # Поддержка BytesIO
-        if isinstance(watermark_path, BytesIO):
-            wm = Image.open(watermark_path).convert("RGBA")
-        else:
-            wm = Image.open(watermark_path).convert("RGBA")
-        # Масштабирование
-        wm_width = int(img.width * scale)
-        wm_ratio = wm_width / wm.width
-        wm_height = int(wm.height * wm_ratio)
-        wm = wm.resize((wm_width, wm_height), Image.Resampling.LANCZOS)
-        # Применение прозрачности
-        if opacity < 1.0:
-            alpha = wm.getchannel("A").point(lambda p: int(p * opacity))
-            wm.putalpha(alpha)
-    elif text:
-        opts = text_options or {}
-        font_path = opts.get("font_path", None)
-        font_size = opts.get("font_size", 36)
-        # Альфа-канал цвета для прозрачности
-        base_color = opts.get("color", (255, 255, 255))
-        if len(base_color) == 3:
-            color = base_color + (int(255 * opacity),)
-        else:
-            color = base_color[:3] + (int(255 * opacity),)
-        if font_path and os.path.exists(font_path):
-            font = ImageFont.truetype(font_path, font_size)
-        else:
-            font = ImageFont.load_default()
-        # Оценка размера текста
-        dummy_img = Image.new("RGBA", (10, 10))
-        draw = ImageDraw.Draw(dummy_img)
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_w, text_h = text_bbox[2] - text_bbox[0], text_bbox[3] - text_bbox[1]
-        # Масштабирование текста
-        scale_factor = (img.width * scale) / text_w
-        font_size_scaled = max(10, int(font_size * scale_factor))
-        if font_path and os.path.exists(font_path):
-            font = ImageFont.truetype(font_path, font_size_scaled)
-        else:
-            font = ImageFont.load_default()
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_w, text_h = text_bbox[2] - text_bbox[0], text_bbox[3] - text_bbox[1]
-        # Создание изображения водяного знака
-        wm = Image.new("RGBA", (int(text_w), int(text_h)), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(wm)
-        draw.text((0, 0), text, font=font, fill=color)
-    else:
-        raise ValueError("Не указан водяной знак")
-    # Позиционирование
-    positions = {
-        "top_left": (0, 0),
-        "top_right": (img.width - wm.width, 0),
-        "center": ((img.width - wm.width) // 2, (img.height - wm.height) // 2),
-        "bottom_left": (0, img.height - wm.height),
-        "bottom_right": (img.width - wm.width, img.height - wm.height),
-    }
-    pos = positions.get(position, positions["bottom_right"])
-    # Вставка водяного знака
-    out = img.copy()
-    out.alpha_composite(wm, dest=pos)
-    return out.convert("RGB")
+    data = user_wm_file.getvalue()
+    ext = os.path.splitext(user_wm_file.name)[1].lower()
+    path = os.path.join(tempfile.gettempdir(), f"user_wm_{watermark_digest(data)[:16]}{ext}")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return path
 
-SUPPORTED_EXTS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff', '.heic', '.heif')
 
-def process_watermark_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position):
+def get_first_image(uploaded_files):
+    """
+    Уменьшенная копия первого подходящего изображения для предпросмотра.
+    Кэшируется по содержимому: sha256 отдельного файла или CRC32+размер члена ZIP
+    из центрального каталога, поэтому при движении слайдеров фото не декодируется заново.
+    """
+    for file in uploaded_files:
+        name = file.name.lower()
+        if name.endswith('.zip'):
+            try:
+                file.seek(0)
+                zf = zipfile.ZipFile(file, 'r')
+            except Exception:
+                continue
+            for info in zf.infolist():
+                if info.is_dir() or not is_supported(info.filename):
+                    continue
+                key = ("zip", info.filename, info.CRC, info.file_size)
+                try:
+                    return get_preview_image(key, lambda info=info: zf.open(info))
+                except Exception:
+                    continue
+        elif is_supported(name):
+            key = ("file", hashlib.sha256(file.getbuffer()).hexdigest())
+            try:
+                return get_preview_image(key, lambda file=file: BytesIO(file.getvalue()))
+            except Exception:
+                continue
+    return None
+
+
+def process_watermark_mode(uploaded_files, preset_choice, user_wm_file, user_wm_path, watermark_dir, pos_map, opacity, size_percent, position, workers=1, profile=DEFAULT_PROFILE, memory_budget_mb=MEMORY_BUDGET_MB, duplicates=DUPLICATES_FANOUT, volume_mb=DEFAULT_VOLUME_MB, sink=None, srgb=None):
     uploaded_files = filter_large_files(uploaded_files)
     if uploaded_files and (preset_choice != "Нет" or user_wm_file):
         if st.button("Обработать и скачать архив", key="process_archive_btn"):
-            import time
-            st.subheader('Обработка изображений...')
-            with tempfile.TemporaryDirectory() as temp_dir:
-                all_images = []
-                log = []
-                # --- Сбор всех файлов ---
-                for uploaded in uploaded_files:
-                    if uploaded.name.lower().endswith(".zip"):
-                        zip_temp = os.path.join(temp_dir, uploaded.name)
-                        with open(zip_temp, "wb") as f:
-                            f.write(uploaded.read())
-                        with zipfile.ZipFile(zip_temp, "r") as zip_ref:
-                            for member in zip_ref.namelist():
-                                try:
-                                    zip_ref.extract(member, temp_dir)
-                                except Exception as e:
-                                    log.append(f"❌ Не удалось извлечь {member} из {uploaded.name}: {e}")
-                        extracted = [file for file in Path(temp_dir).rglob("*") if file.is_file() and file.suffix.lower() in SUPPORTED_EXTS]
-                        log.append(f"📦 Архив {uploaded.name}: найдено {len(extracted)} изображений.")
-                        all_images.extend(extracted)
-                    elif uploaded.name.lower().endswith(SUPPORTED_EXTS):
-                        img_temp = os.path.join(temp_dir, uploaded.name)
-                        with open(img_temp, "wb") as f:
-                            f.write(uploaded.read())
-                        all_images.append(Path(img_temp))
-                        log.append(f"🖼️ Файл {uploaded.name}: добавлен.")
-                    else:
-                        log.append(f"❌ {uploaded.name}: не поддерживается.")
+            job_dir = new_result_dir()
+            # Задание читает загрузки через свои потоки: интерфейс может обращаться к ним одновременно
+            uploads = detach_uploads(uploaded_files, memory_budget_mb=memory_budget_mb)
+            result_zip = os.path.join(job_dir, "result_watermark.zip")
+            watermark_path = None
+            if preset_choice != "Нет":
+                watermark_path = os.path.join(watermark_dir, preset_choice)
+            elif user_wm_file:
+                watermark_path = user_wm_path
+
+            def task(job):
+                # Выполняется в фоновом потоке: без вызовов st.*
+                # --- Сбор всех файлов (без распаковки архивов на диск) ---
+                metrics = JobMetrics("watermark")
+                with metrics.span("ingest"):
+                    all_images = list(iter_sources(uploads, job.log))
                 if not all_images:
-                    st.error("Не найдено ни одного поддерживаемого изображения.")
-                    # Создаём пустой архив с логом ошибок
-                    result_zip = os.path.join(temp_dir, "result_watermark.zip")
-                    with zipfile.ZipFile(result_zip, "w") as zipf:
-                        log_path = os.path.join(temp_dir, "log.txt")
-                        with open(log_path, "w", encoding="utf-8") as logf:
-                            logf.write("\n".join(log))
-                        zipf.write(log_path, arcname="log.txt")
-                    with open(result_zip, "rb") as f:
-                        st.session_state["result_zip"] = f.read()
-                    st.session_state["stats"] = {"total": 0, "processed": 0, "errors": 0}
-                    st.session_state["log"] = log
-                else:
-                    watermark_path = None
-                    if preset_choice != "Нет":
-                        watermark_path = os.path.join(watermark_dir, preset_choice)
-                    elif user_wm_file:
-                        watermark_path = user_wm_path
+                    job.report("Не найдено ни одного поддерживаемого изображения.")
+                elif not watermark_path:
+                    job.report("Не удалось обработать ни одного изображения.")
+                    all_images = []
+                # Готовые тома отправляются в фоне, пока пишутся следующие
+                uploader = job.uploader = SinkUploader(sink or BrowserDownloadSink(), job.log)
+                result = run_watermark(
+                    all_images,
+                    result_zip,
+                    watermark_path,
+                    position=pos_map[position],
+                    opacity=opacity,
+                    scale=size_percent/100.0,
+                    log=job.log,
+                    workers=workers,
+                    profile=profile,
+                    progress=job.progress,
+                    on_error=job.report,
+                    metrics=metrics,
+                    cache=default_result_cache(),
+                    memory_budget_mb=memory_budget_mb,
+                    duplicates=duplicates,
+                    volume_mb=volume_mb,
+                    on_volume=uploader.submit,
+                    pool=job.pool,
+                    srgb=srgb,
+                )
+                uploader.finish(result.volumes)
+                if result.error is not None:
+                    job.report(f"Ошибка при архивации или чтении архива: {result.error}")
+                return result
 
-                    processed_files = []
-                    errors = 0
-                    if watermark_path:
-                        progress_bar = st.progress(0, text="Файлы...")
-                        for i, img_path in enumerate(all_images, 1):
-                            rel_path = img_path.relative_to(temp_dir)
-                            out_path = os.path.join(temp_dir, str(rel_path.with_suffix('.jpg')))
-                            out_dir = os.path.dirname(out_path)
-                            os.makedirs(out_dir, exist_ok=True)
-                            start_time = time.time()
-                            try:
-                                img = Image.open(img_path)
-                                processed_img = apply_watermark(
-                                    img,
-                                    watermark_path=watermark_path,
-                                    position=pos_map[position],
-                                    opacity=opacity,
-                                    scale=size_percent/100.0
-                                )
-                                processed_img.save(out_path, "JPEG", quality=100, optimize=True, progressive=True)
-                                processed_files.append((out_path, rel_path.with_suffix('.jpg')))
-                                log.append(f"✅ {rel_path} → {rel_path.with_suffix('.jpg')} (время: {time.time() - start_time:.2f} сек)")
-                            except Exception as e:
-                                log.append(f"❌ {rel_path}: ошибка обработки водяного знака ({e}) (время: {time.time() - start_time:.2f} сек)")
-                                st.error(f"Ошибка при обработке {rel_path}: {e}")
-                                errors += 1
-                            progress_bar.progress(i / len(all_images), text=f"Обработано файлов: {i}/{len(all_images)}")
-                        # Архивация только обработанных файлов
-                        files_to_zip = [Path(out_path) for out_path, _ in processed_files]
-                        log_path = os.path.join(temp_dir, "log.txt")
-                        if os.path.exists(log_path):
-                            files_to_zip.append(Path(log_path))
-                        try:
-                            result_zip = os.path.join(temp_dir, "result_watermark.zip")
-                            with zipfile.ZipFile(result_zip, "w") as zipf:
-                                for file in files_to_zip:
-                                    arcname = file.relative_to(Path(temp_dir))
-                                    zipf.write(file, arcname=arcname)
-                            with open(result_zip, "rb") as f:
-                                st.session_state["result_zip"] = f.read()
-                            st.session_state["stats"] = {
-                                "total": len(all_images),
-                                "processed": len(processed_files),
-                                "errors": errors
-                            }
-                            st.session_state["log"] = log
-                        except Exception as e:
-                            st.error(f"Ошибка при архивации или чтении архива: {e}")
-                            result_zip = os.path.join(temp_dir, "result_watermark.zip")
-                            with zipfile.ZipFile(result_zip, "w") as zipf:
-                                log.append(f"Ошибка архивации: {e}")
-                                log_path = os.path.join(temp_dir, "log.txt")
-                                with open(log_path, "w", encoding="utf-8") as logf:
-                                    logf.write("\n".join(log))
-                                zipf.write(log_path, arcname="log.txt")
-                            with open(result_zip, "rb") as f:
-                                st.session_state["result_zip"] = f.read()
-                            st.session_state["stats"] = {"total": len(all_images), "processed": len(processed_files), "errors": errors}
-                            st.session_state["log"] = log
-                    else:
-                        st.error("Не удалось обработать ни одного изображения.")
-                        # Создаём архив только с логом ошибок
-                        result_zip = os.path.join(temp_dir, "result_watermark.zip")
-                        with zipfile.ZipFile(result_zip, "w") as zipf:
-                            log_path = os.path.join(temp_dir, "log.txt")
-                            with open(log_path, "w", encoding="utf-8") as logf:
-                                logf.write("\n".join(log))
-                            zipf.write(log_path, arcname="log.txt")
-                        with open(result_zip, "rb") as f:
-                            st.session_state["result_zip"] = f.read()
-                        st.session_state["stats"] = {"total": len(all_images), "processed": 0, "errors": errors}
-                        st.session_state["log"] = log
+            submit_job("watermark", result_zip, task)
 
 # Фильтр больших файлов (оставить для совместимости)
 def filter_large_files(uploaded_files):